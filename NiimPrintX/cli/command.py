@@ -1,16 +1,26 @@
 import asyncio
+import io
 import click
-from PIL import Image
 from NiimPrintX.nimmy.bluetooth import find_device
-from NiimPrintX.nimmy.printer import PrinterClient, InfoEnum
+from NiimPrintX.nimmy.printer import PrinterClient, InfoEnum, JobOutcome
+from NiimPrintX.nimmy.job import PrintJob, job_cache
 from NiimPrintX.nimmy.logger_config import setup_logger, get_logger, logger_enable
-from NiimPrintX.nimmy.helper import print_info, print_error, print_success
+from NiimPrintX.nimmy.helper import print_info, print_error, print_success, console
+from rich.progress import Progress
 
 from devtools import debug
 
 setup_logger()
 logger = get_logger()
 
+# Pillow and everything built on it is imported inside the commands that render, so sending a compiled
+# job starts without it. The modes are the ones of raster.DITHER_MODES.
+DITHER_MODES = ("diffusion", "threshold", "ordered")
+
+
+def max_width(model):
+    return 384 if model in ("b1", "b18", "b21") else 240
+
 
 @click.group(context_settings={"help_option_names": ['-h', '--help']})
 @click.option(
@@ -78,47 +88,441 @@ def niimbot_cli(ctx, verbose):
     "-i",
     "--image",
     type=click.Path(exists=True),
-    required=True,
-    help="Image path",
+    help="Image path, binary PBM files are streamed from disk",
+)
+@click.option(
+    "--doc",
+    "document",
+    type=click.Path(exists=True),
+    help="Label document (JSON) to render and print instead of an image",
 )
-def print_command(model, density, rotate, image, quantity, vertical_offset, horizontal_offset):
+@click.option(
+    "--dither",
+    type=click.Choice(DITHER_MODES, False),
+    default="diffusion",
+    show_default=True,
+    help="Halftoning of grey pixels",
+)
+@click.option(
+    "--threshold",
+    type=click.IntRange(0, 255),
+    default=128,
+    show_default=True,
+    help="Grey level below which pixels print, for --dither threshold",
+)
+def print_command(model, density, rotate, image, document, quantity, vertical_offset, horizontal_offset, dither,
+                  threshold):
     logger.info(f"Niimbot Printing Start")
 
-    if model in ("b1", "b18", "b21"):
-        max_width_px = 384
-    if model in ("d11", "d110"):
-        max_width_px = 240
+    if bool(image) == bool(document):
+        raise click.UsageError("Provide exactly one of --image or --doc")
 
     if model in ("b18", "d11", "d110") and density > 3:
         density = 3
     try:
-        image = Image.open(image)
+        if image and image.lower().endswith(".pbm"):
+            from NiimPrintX.nimmy.raster import PBMSource
 
-        if rotate != "0":
-            # PIL library rotates counterclockwise, so we need to multiply by -1
-            image = image.rotate(-int(rotate), expand=True)
-        assert image.width <= max_width_px, f"Image width too big for {model.upper()}"
-        asyncio.run(_print(model, density, image, quantity, vertical_offset, horizontal_offset))
+            # Bitmaps are streamed from the file, long banners never have to fit in memory
+            job = PBMSource(image, int(rotate))
+        else:
+            job = encode_job(model, density, quantity, rotate, image, document, vertical_offset,
+                             horizontal_offset, dither, threshold)
+        assert job.width <= max_width(model), f"Image width too big for {model.upper()}"
+        asyncio.run(_print(model, density, job, quantity, vertical_offset, horizontal_offset))
     except Exception as e:
         logger.info(f"{e}")
 
 
-async def _print(model, density, image, quantity, vertical_offset, horizontal_offset):
+def encode_job(model, density, quantity, rotate, image, document, vertical_offset, horizontal_offset, dither,
+               threshold):
+    """Encode an image or label document into a ``PrintJob``, going through the job cache."""
+    from PIL import Image
+    from NiimPrintX.nimmy.imagecache import image_cache
+    from NiimPrintX.nimmy.label import LabelRenderer, load_document
+    from NiimPrintX.nimmy.raster import ImageSource, PBMSource
+
+    if image and image.lower().endswith(".pbm"):
+        return PrintJob.from_source(PBMSource(image, int(rotate)), model, density, quantity, vertical_offset,
+                                    horizontal_offset)
+
+    # Everything that changes the encoded rows, the same label with the same settings is encoded only once
+    settings = dict(model=model, density=density, vertical_offset=vertical_offset,
+                    horizontal_offset=horizontal_offset, dither=dither, threshold=threshold, rotate=int(rotate))
+    if document:
+        # Keyed by the document and the image files it refers to, a cache hit renders nothing
+        label = load_document(document)
+        with open(document, "rb") as f:
+            content = f.read()
+        images = [image_cache.file_key(item["path"]) for item in label.get("image", []) if "path" in item]
+        key = job_cache.key(content + repr(images).encode(), **settings)
+    else:
+        # Keyed by the file content, a cache hit does not even decode the image
+        with open(image, "rb") as f:
+            content = f.read()
+        key = job_cache.key(content, **settings)
+
+    job = job_cache.get(key)
+    if job is None:
+        if document:
+            # One halftoning step in print orientation, the same rows as printing the label from the GUI
+            source = LabelRenderer().raster_source(label, dither=dither, threshold=threshold, rotate=int(rotate))
+        else:
+            source = ImageSource(Image.open(io.BytesIO(content)), int(rotate), dither, threshold)
+        job = PrintJob.from_source(source, model, density, quantity, vertical_offset, horizontal_offset)
+        job_cache.put(key, job)
+    job.quantity = quantity
+    return job
+
+
+async def _print(model, density, job, quantity, vertical_offset, horizontal_offset):
     try:
         print_info("Starting print job")
         device = await find_device(model)
         printer = PrinterClient(device)
         if await printer.connect():
             print(f"Connected to {device.name}")
-        await printer.print_image(image, density=density, quantity=quantity, vertical_offset=vertical_offset,
-                                  horizontal_offset=horizontal_offset)
-        print_success("Print job completed")
+        with Progress(console=console) as progress:
+            task = progress.add_task("Sending label", total=None)
+
+            def on_progress(event):
+                if event["stage"] == "sending":
+                    progress.update(task, completed=event["rows_sent"], total=event["rows_total"],
+                                    description=f"Sending label ({event['bytes_per_second'] / 1024:.1f} KB/s)")
+                elif event["stage"] == "printing":
+                    progress.update(task, completed=event["pages_done"], total=event["pages_total"],
+                                    description="Printing")
+
+            if isinstance(job, PrintJob):
+                outcome = await printer.print_job(job, quantity, on_progress=on_progress)
+            else:
+                outcome = await printer.print_source(job, density=density, quantity=quantity,
+                                                     vertical_offset=vertical_offset,
+                                                     horizontal_offset=horizontal_offset, on_progress=on_progress)
+        match outcome:
+            case JobOutcome.COMPLETED:
+                print_success("Print job completed")
+            case JobOutcome.RESTARTED:
+                print_success("Print job completed, the label was sent again after the connection dropped")
+            case _:
+                print_error("Print job abandoned, the connection to the printer could not be restored")
         await printer.disconnect()
     except Exception as e:
         logger.debug(f"{e}")
         await printer.disconnect()
 
 
+@niimbot_cli.command("compile")
+@click.option(
+    "-m",
+    "--model",
+    type=click.Choice(["b1", "b18", "b21", "d11", "d110"], False),
+    default="d110",
+    show_default=True,
+    help="Niimbot printer model",
+)
+@click.option(
+    "-d",
+    "--density",
+    type=click.IntRange(1, 5),
+    default=3,
+    show_default=True,
+    help="Print density",
+)
+@click.option(
+    "-n",
+    "--quantity",
+    default=1,
+    show_default=True,
+    help="Print quantity",
+)
+@click.option(
+    "--vo",
+    "vertical_offset",
+    default=0,
+    show_default=True,
+    help="Vertical offset in pixels",
+)
+@click.option(
+    "--ho",
+    "horizontal_offset",
+    default=0,
+    show_default=True,
+    help="Horizontal offset in pixels",
+)
+@click.option(
+    "-r",
+    "--rotate",
+    type=click.Choice(["0", "90", "180", "270"]),
+    default="0",
+    show_default=True,
+    help="Image rotation (clockwise)",
+)
+@click.option(
+    "-i",
+    "--image",
+    type=click.Path(exists=True),
+    help="Image path, binary PBM files are streamed from disk",
+)
+@click.option(
+    "--doc",
+    "document",
+    type=click.Path(exists=True),
+    help="Label document (JSON) to render instead of an image",
+)
+@click.option(
+    "--dither",
+    type=click.Choice(DITHER_MODES, False),
+    default="diffusion",
+    show_default=True,
+    help="Halftoning of grey pixels",
+)
+@click.option(
+    "--threshold",
+    type=click.IntRange(0, 255),
+    default=128,
+    show_default=True,
+    help="Grey level below which pixels print, for --dither threshold",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(),
+    required=True,
+    help="Job file to write",
+)
+def compile_command(model, density, rotate, image, document, quantity, vertical_offset, horizontal_offset, dither,
+                    threshold, output):
+    logger.info("Niimbot Compile")
+
+    if bool(image) == bool(document):
+        raise click.UsageError("Provide exactly one of --image or --doc")
+
+    if model in ("b18", "d11", "d110") and density > 3:
+        density = 3
+    try:
+        job = encode_job(model, density, quantity, rotate, image, document, vertical_offset, horizontal_offset,
+                         dither, threshold)
+        assert job.width <= max_width(model), f"Image width too big for {model.upper()}"
+        job.write(output)
+        print_success(f"Job compiled to {output} ({job.width}x{job.height}, {job.rows} rows)")
+    except Exception as e:
+        logger.debug(f"{e}")
+        print_error(e)
+
+
+@niimbot_cli.command("send")
+@click.option(
+    "-m",
+    "--model",
+    type=click.Choice(["b1", "b18", "b21", "d11", "d110"], False),
+    default=None,
+    help="Niimbot printer model  [default: model the job was compiled for]",
+)
+@click.option(
+    "-n",
+    "--quantity",
+    type=click.IntRange(1),
+    default=None,
+    help="Print quantity  [default: quantity in the job]",
+)
+@click.option(
+    "-f",
+    "--file",
+    "job_file",
+    type=click.Path(exists=True),
+    required=True,
+    help="Job file written by the compile command",
+)
+def send_command(model, quantity, job_file):
+    logger.info("Niimbot Send")
+    try:
+        job = PrintJob.open(job_file)
+        model = model or job.model
+        if not model:
+            raise click.UsageError("The job does not name a printer model, pass --model")
+        assert job.width <= max_width(model), f"Job width too big for {model.upper()}"
+        asyncio.run(_print(model, job.density, job, quantity or job.quantity, 0, 0))
+    except click.UsageError:
+        raise
+    except Exception as e:
+        logger.debug(f"{e}")
+        print_error(e)
+
+
+@niimbot_cli.command("batch")
+@click.option(
+    "-m",
+    "--model",
+    type=click.Choice(["b1", "b18", "b21", "d11", "d110"], False),
+    default="d110",
+    show_default=True,
+    help="Niimbot printer model",
+)
+@click.option(
+    "-d",
+    "--density",
+    type=click.IntRange(1, 5),
+    default=3,
+    show_default=True,
+    help="Print density",
+)
+@click.option(
+    "-n",
+    "--quantity",
+    default=1,
+    show_default=True,
+    help="Print quantity of each label",
+)
+@click.option(
+    "--vo",
+    "vertical_offset",
+    default=0,
+    show_default=True,
+    help="Vertical offset in pixels",
+)
+@click.option(
+    "--ho",
+    "horizontal_offset",
+    default=0,
+    show_default=True,
+    help="Horizontal offset in pixels",
+)
+@click.option(
+    "-t",
+    "--template",
+    type=click.Path(exists=True),
+    required=True,
+    help="Label document (JSON) with {field} placeholders",
+)
+@click.option(
+    "-f",
+    "--data",
+    type=click.Path(exists=True),
+    required=True,
+    help="CSV file with a header line or JSON-lines (.jsonl) file",
+)
+@click.option(
+    "--start-row",
+    default=0,
+    show_default=True,
+    help="Skip data rows before this index to resume a batch",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(1),
+    default=None,
+    help="Render processes  [default: number of CPUs]",
+)
+@click.option(
+    "--dither",
+    type=click.Choice(DITHER_MODES, False),
+    default="diffusion",
+    show_default=True,
+    help="Halftoning of grey pixels",
+)
+@click.option(
+    "--threshold",
+    type=click.IntRange(0, 255),
+    default=128,
+    show_default=True,
+    help="Grey level below which pixels print, for --dither threshold",
+)
+def batch_command(model, density, quantity, vertical_offset, horizontal_offset, template, data, start_row, jobs,
+                  dither, threshold):
+    logger.info("Niimbot Batch Printing Start")
+
+    from NiimPrintX.nimmy.label import load_document
+    from NiimPrintX.nimmy.batch import count_rows
+
+    if model in ("b18", "d11", "d110") and density > 3:
+        density = 3
+    try:
+        template = load_document(template)
+        total = count_rows(data)
+        asyncio.run(_batch(model, density, quantity, vertical_offset, horizontal_offset, template, data, total,
+                           start_row, jobs, max_width(model), dither, threshold))
+    except Exception as e:
+        logger.debug(f"{e}")
+        print_error(e)
+
+
+async def _batch(model, density, quantity, vertical_offset, horizontal_offset, template, data, total, start_row,
+                 jobs, max_width_px, dither, threshold):
+    from NiimPrintX.nimmy.batch import read_rows, print_batch
+
+    print_info("Starting batch print job")
+    device = await find_device(model)
+    printer = PrinterClient(device)
+    next_row = start_row
+    try:
+        if await printer.connect():
+            print(f"Connected to {device.name}")
+        with Progress(console=console) as progress:
+            task = progress.add_task("Printing labels", total=total, completed=start_row)
+
+            def on_progress(index):
+                nonlocal next_row
+                next_row = index + 1
+                progress.update(task, completed=next_row)
+
+            await print_batch(printer, template, read_rows(data), density=density, quantity=quantity,
+                              start_row=start_row, workers=jobs, vertical_offset=vertical_offset,
+                              horizontal_offset=horizontal_offset, max_width=max_width_px, dither=dither,
+                              threshold=threshold, on_progress=on_progress)
+        print_success(f"Batch print job completed ({max(total - start_row, 0)} labels)")
+    except Exception as e:
+        logger.debug(f"{e}")
+        print_error(f"Batch stopped at row {next_row}: {e}")
+        print_info(f"Resume with --start-row {next_row}")
+    finally:
+        await printer.disconnect()
+
+
+@niimbot_cli.command("render")
+@click.option(
+    "-d",
+    "--doc",
+    "document",
+    type=click.Path(exists=True),
+    required=True,
+    help="Label document (JSON)",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(),
+    required=True,
+    help="Output image path",
+)
+@click.option(
+    "--dither",
+    type=click.Choice(DITHER_MODES, False),
+    default="diffusion",
+    show_default=True,
+    help="Halftoning of grey pixels",
+)
+@click.option(
+    "--threshold",
+    type=click.IntRange(0, 255),
+    default=128,
+    show_default=True,
+    help="Grey level below which pixels print, for --dither threshold",
+)
+def render_command(document, output, dither, threshold):
+    from NiimPrintX.nimmy.label import LabelRenderer, load_document
+
+    logger.info("Niimbot Render")
+    try:
+        image = LabelRenderer().rasterize(load_document(document), dither=dither, threshold=threshold)
+        image.save(output)
+        print_success(f"Label rendered to {output} ({image.width}x{image.height})")
+    except Exception as e:
+        logger.debug(f"{e}")
+        print_error(e)
+
+
 @niimbot_cli.command("info")
 @click.option(
     "-m",
@@ -139,9 +543,8 @@ async def _info(model):
         device = await find_device(model)
         printer = PrinterClient(device)
         await printer.connect()
-        device_serial = await printer.get_info(InfoEnum.DEVICESERIAL)
-        software_version = await printer.get_info(InfoEnum.SOFTVERSION)
-        hardware_version = await printer.get_info(InfoEnum.HARDVERSION)
+        device_serial, software_version, hardware_version = await printer.get_infos(
+            [InfoEnum.DEVICESERIAL, InfoEnum.SOFTVERSION, InfoEnum.HARDVERSION])
         print(f"Device Serial : {device_serial}")
         print(f"Software Version : {software_version}")
         print(f"Hardware Version : {hardware_version}")
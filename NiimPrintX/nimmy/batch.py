@@ -0,0 +1,146 @@
+import asyncio
+import copy
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .exception import PrinterException
+from .label import LabelRenderer, is_static
+from .job import PrintJob
+from .printer import JobOutcome
+from .logger_config import get_logger
+
+logger = get_logger()
+
+MAX_QUANTITY = 65535  # SET_QUANTITY takes a 16 bit count
+
+_renderer = None
+_template = None
+_background = None
+
+
+def read_rows(data_path):
+    """Yield the rows of a CSV file (with a header line) or a JSON-lines file one at a time."""
+    if data_path.lower().endswith((".jsonl", ".ndjson")):
+        with open(data_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(data_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def count_rows(data_path):
+    return sum(1 for _ in read_rows(data_path))
+
+
+def fill_template(template, row):
+    """Substitute ``{field}`` placeholders in text content and image paths with values from the row.
+
+    Items keep whether they were static in the template so a cached background can be reused.
+    """
+    document = copy.deepcopy(template)
+    for item in document.get("text", []):
+        item["static"] = is_static(item)
+        if not item["static"]:
+            item["content"] = item["content"].format_map(row)
+    for item in document.get("image", []):
+        item["static"] = is_static(item)
+        if not item["static"] and "path" in item:
+            item["path"] = item["path"].format_map(row)
+    return document
+
+
+def _init_worker(template):
+    global _renderer, _template, _background
+    _renderer = LabelRenderer()
+    _template = template
+    _background = None
+
+
+def render_label(row, vertical_offset=0, horizontal_offset=0, max_width=None, dither="diffusion", threshold=128):
+    """Render and encode one row of a batch, runs inside the worker processes."""
+    global _background
+    if _background is None:
+        # The static layer is the same for every row, render it once per worker
+        _background = _renderer.render_background(_template)
+    source = _renderer.raster_source(fill_template(_template, row), background=_background, dither=dither,
+                                     threshold=threshold)
+    if max_width and source.width > max_width:
+        raise PrinterException(f"Label width {source.width} is too big, printer supports {max_width} pixels")
+    job = PrintJob.from_source(source, vertical_offset=vertical_offset, horizontal_offset=horizontal_offset)
+    # Identical labels are recognised by this digest so runs of them can be printed as one page
+    digest = hashlib.sha256(job.header() + job.data).digest()
+    return job, digest
+
+
+async def print_batch(printer, template, rows, density=3, quantity=1, start_row=0, workers=None,
+                      queue_size=None, vertical_offset=0, horizontal_offset=0, max_width=None, dither="diffusion",
+                      threshold=128, on_progress=None):
+    """Render rows in a process pool and print them in order as they become ready.
+
+    Rendering is limited to ``queue_size`` labels ahead of the printer so memory use does not grow with
+    the number of rows. Consecutive rows that encode to the same raster are sent once with a higher
+    quantity, the printer repeats them from its own buffer. ``on_progress`` is called with the index of
+    the last row of every page that finished printing, rows before ``start_row`` are skipped which
+    allows resuming an interrupted batch.
+    """
+    workers = workers or os.cpu_count() or 1
+    queue = asyncio.Queue(maxsize=queue_size or workers * 2)
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template,)) as pool:
+        async def produce():
+            try:
+                for index, row in enumerate(rows):
+                    if index < start_row:
+                        continue
+                    future = loop.run_in_executor(pool, render_label, row, vertical_offset, horizontal_offset,
+                                                  max_width, dither, threshold)
+                    await queue.put((index, future))
+            except Exception:
+                # A bad data row ends the batch, the rows before it are still printed and then this is raised
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        async def print_run(job, first, last):
+            logger.debug(f"Printing batch rows {first} to {last}")
+            outcome = await printer.print_job(job, quantity * (last - first + 1))
+            if outcome == JobOutcome.ABANDONED:
+                raise PrinterException(f"Label for rows {first} to {last} abandoned, the connection was lost")
+            if on_progress:
+                on_progress(last)
+
+        producer = asyncio.create_task(produce())
+        try:
+            run = None  # (job, digest, first index, last index) of the labels waiting to be printed
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    break
+                index, future = entry
+                job, digest = await future
+                job.density = density
+                if run and run[1] == digest and (index - run[2] + 1) * quantity <= MAX_QUANTITY:
+                    run = (run[0], digest, run[2], index)
+                    continue
+                if run:
+                    await print_run(run[0], run[2], run[3])
+                run = (job, digest, index, index)
+            if run:
+                await print_run(run[0], run[2], run[3])
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+                # Pending renders are dropped, nothing will consume them
+                while not queue.empty():
+                    entry = queue.get_nowait()
+                    if entry is not None:
+                        entry[1].cancel()
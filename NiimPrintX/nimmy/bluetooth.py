@@ -54,11 +54,11 @@ class BLETransport:
             await self.client.disconnect()
             logger.info("Disconnected.")
 
-    async def connect(self, address, timeout=10):
+    async def connect(self, address, timeout=10, disconnected_callback=None):
         logger.debug(f"BLETransport.connect() called with address={address}")
         if self.client is None:
             logger.debug(f"Creating new BleakClient for {address}")
-            self.client = BleakClient(address, timeout=timeout)
+            self.client = BleakClient(address, disconnected_callback=disconnected_callback, timeout=timeout)
         if not self.client.is_connected:
             logger.info(f"Attempting to connect to {address}...")
             try:
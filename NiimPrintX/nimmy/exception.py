@@ -2,4 +2,14 @@ class BLEException(Exception):
     pass
 
 class PrinterException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class DisconnectedException(BLEException):
+    """The link to the printer dropped and could not be brought back in time."""
+    pass
+
+
+class CommandTimeoutException(PrinterException):
+    """The printer did not answer a request, queries were retried before this is raised."""
+    pass
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+def _entry_size(value):
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_entry_size(v) for v in value)
+    return 64
+
+
+class ImageCache:
+    """Process wide LRU of decoded images and anything derived from them, bounded by size in bytes.
+
+    Cached images are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        value = factory()
+        size = _entry_size(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.current_bytes += size
+                self._evict()
+            return self._entries[key][0] if key in self._entries else value
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    @staticmethod
+    def file_key(path):
+        # A changed file gets a new key, stale entries simply age out
+        stat = os.stat(path)
+        return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+    def open_image(self, path):
+        """Decoded image for a file, the file is read only the first time."""
+        return self.get_or_create(("file",) + self.file_key(path), lambda: _load(path))
+
+    def image_size(self, path):
+        """Size of the image in a file, only the header is read."""
+        def read_size():
+            with Image.open(path) as image:
+                return image.size
+
+        return self.get_or_create(("size",) + self.file_key(path), read_size)
+
+    def variant(self, path, name, factory):
+        """Value derived from a file such as a resized copy, ``factory(path)`` runs only on a miss."""
+        return self.get_or_create(("variant", name) + self.file_key(path), lambda: factory(path))
+
+    def encoded_png(self, image):
+        """Return (sha256, PNG bytes) for an image, the image is kept alive with the entry."""
+        def encode():
+            with io.BytesIO() as buffer:
+                image.save(buffer, format="PNG")
+                data = buffer.getvalue()
+            return image, hashlib.sha256(data).hexdigest(), data
+
+        _, asset_hash, data = self.get_or_create(("png", id(image)), encode)
+        return asset_hash, data
+
+
+def _load(path):
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+image_cache = ImageCache()
@@ -0,0 +1,188 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+import appdirs
+
+from .packet import row_packet
+from .logger_config import get_logger
+
+logger = get_logger()
+
+JOB_MAGIC = b"NIMJ"
+JOB_VERSION = 1
+# magic, version, model, width, height, density, quantity, rows, row stride, crc32 of the rows
+JOB_HEADER = struct.Struct(">4sB8sHHBHIHI")
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+ROW_HEADER_SIZE = 6  # Row number, three counts and a constant one in front of every row packet
+
+
+class PrintJob:
+    """One encoded page with its print settings, everything needed to print it without any image work.
+
+    ``data`` holds the packed printer rows back to back, it can be a memory map of a job file.
+    """
+
+    def __init__(self, width, height, data, stride, rows=None, model="", density=3, quantity=1):
+        self.width = width
+        self.height = height
+        self.data = data
+        self.stride = stride
+        self.rows = len(data) // stride if rows is None else rows
+        self.model = model
+        self.density = density
+        self.quantity = quantity
+
+    @classmethod
+    def from_packets(cls, packets, width, height, model="", density=3, quantity=1):
+        rows = [pkt.data[ROW_HEADER_SIZE:] for pkt in packets]
+        stride = len(rows[0]) if rows else 0
+        return cls(width, height, b"".join(rows), stride, len(rows), model, density, quantity)
+
+    @classmethod
+    def from_source(cls, source, model="", density=3, quantity=1, vertical_offset=0, horizontal_offset=0):
+        """Encode a ``RasterSource``, see ``encode_source``."""
+        from .raster import encode_source
+
+        packets = encode_source(source, vertical_offset, horizontal_offset)
+        return cls.from_packets(packets, source.width, source.height, model, density, quantity)
+
+    @property
+    def checksum(self):
+        return zlib.crc32(self.data) & 0xFFFFFFFF
+
+    def packets(self):
+        """Yield the row packets, rows are sliced out of ``data`` one at a time."""
+        for y in range(self.rows):
+            yield row_packet(y, bytes(self.data[y * self.stride:(y + 1) * self.stride]))
+
+    def header(self):
+        return JOB_HEADER.pack(JOB_MAGIC, JOB_VERSION, self.model.encode("ascii")[:8], self.width, self.height,
+                               self.density, self.quantity, self.rows, self.stride, self.checksum)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Read a job from ``to_bytes`` output, raises ValueError for anything that is not a valid job."""
+        if len(data) < JOB_HEADER.size:
+            raise ValueError("Job data is truncated")
+        magic, version, model, width, height, density, quantity, rows, stride, checksum = \
+            JOB_HEADER.unpack_from(data)
+        if magic != JOB_MAGIC or version != JOB_VERSION:
+            raise ValueError("Not a print job file, or written by a different version")
+        payload = memoryview(data)[JOB_HEADER.size:JOB_HEADER.size + rows * stride]
+        if len(payload) != rows * stride:
+            raise ValueError("Job data is truncated")
+        if zlib.crc32(payload) & 0xFFFFFFFF != checksum:
+            raise ValueError("Job data is corrupted")
+        return cls(width, height, payload, stride, rows, model.rstrip(b"\0").decode("ascii"), density, quantity)
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a job file, rows are paged in from disk while they are sent."""
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_bytes(data)
+
+    def to_bytes(self):
+        return self.header() + bytes(self.data)
+
+    def write(self, path):
+        """Write the job atomically, a reader never sees a half written file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.header())
+                f.write(self.data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class JobCache:
+    """Encoded jobs on disk, keyed by a hash of the label content and every setting that changes the rows.
+
+    Files are evicted least recently used first once they take more than ``max_bytes``, a hit updates
+    the file's modification time.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or os.path.join(appdirs.user_cache_dir('NiimPrintX'), "jobs")
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(content, **settings):
+        digest = hashlib.sha256(repr(sorted(settings.items())).encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    @classmethod
+    def image_key(cls, image, **settings):
+        return cls.key(image.tobytes(), mode=image.mode, size=image.size, **settings)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.job")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                job = PrintJob.from_bytes(f.read())
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cached job {path}: {e}")
+            self._remove(path)
+            return None
+        logger.debug(f"Print job cache hit {key}")
+        return job
+
+    def put(self, key, job):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            job.write(self._path(key))
+            self._evict()
+        except OSError as e:
+            # The cache is only an optimisation, printing goes on without it
+            logger.warning(f"Cannot write print job cache: {e}")
+
+    def get_or_create(self, key, factory):
+        job = self.get(key)
+        if job is None:
+            job = factory()
+            self.put(key, job)
+        return job
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".job"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".job"):
+                    self._remove(entry.path)
+
+
+job_cache = JobCache()
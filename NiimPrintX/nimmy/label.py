@@ -0,0 +1,223 @@
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from string import Formatter
+
+from PIL import Image, ImageChops
+
+from .imagecache import image_cache
+from .logger_config import get_logger
+from .raster import ImageSource
+
+logger = get_logger()
+
+TEXT_RENDER_DPI = 300  # Wand renders text at 300 DPI for high quality output
+TEXT_CACHE_SIZE = 256  # Number of rendered text bitmaps kept by a renderer
+
+
+def mm_to_pixels(mm, dpi=203):
+    inches = mm / 25.4
+    return int(inches * dpi)
+
+
+def load_document(file_path):
+    """Read a JSON label document, relative image paths are resolved against the document folder."""
+    with open(file_path, "r") as f:
+        document = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(file_path))
+    for item in document.get("image", []):
+        if "path" in item and not os.path.isabs(item["path"]):
+            item["path"] = os.path.join(base_dir, item["path"])
+    return document
+
+
+def is_static(item):
+    """Static items look the same on every label of a batch, by default anything without a {field}."""
+    if "static" in item:
+        return bool(item["static"])
+    value = item.get("content", item.get("path", ""))
+    return not any(field is not None for _, field, _, _ in Formatter().parse(value))
+
+
+class LabelRenderer:
+    """Render label documents without a display.
+
+    A document is a dict with the label size (``size`` in pixels or ``label_size`` in mm), a list of
+    ``text`` items (``content``, ``font_props``, ``coords``) and a list of ``image`` items (``path``,
+    ``coords`` and optional ``size``). Coordinates are pixels relative to the top left of the label.
+    Items may carry an already rendered PIL ``bitmap`` which is used as is, this is how the GUI hands
+    over what is on the canvas.
+
+    Items are static or variable (see ``is_static``). The static layer can be rendered once with
+    ``render_background`` and passed back as ``background``, then only the variable items are drawn
+    on top of a copy of it.
+
+    Rendered text is cached by content and ``font_props``, the cached bitmaps are shared and must not
+    be modified by callers.
+    """
+
+    def __init__(self, dpi=203):
+        self.dpi = dpi
+        self._text_cache = OrderedDict()
+        self._text_pending = {}
+        self._text_lock = threading.Lock()
+        self._executor = None
+
+    def render_text(self, font_props, text):
+        key = self._text_key(font_props, text)
+        with self._text_lock:
+            image = self._text_cache.get(key)
+            if image is not None:
+                self._text_cache.move_to_end(key)
+                return image
+
+        image = self._render_text(font_props, text)
+        with self._text_lock:
+            self._text_cache[key] = image
+            while len(self._text_cache) > TEXT_CACHE_SIZE:
+                self._text_cache.popitem(last=False)
+        return image
+
+    def render_text_async(self, font_props, text):
+        """Render text on a worker thread and return a future, identical requests share one render."""
+        key = self._text_key(font_props, text)
+        with self._text_lock:
+            if key in self._text_cache:
+                future = Future()
+                future.set_result(self._text_cache[key])
+                return future
+            if key in self._text_pending:
+                return self._text_pending[key]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="text-render")
+            future = self._executor.submit(self.render_text, dict(font_props), text)
+            self._text_pending[key] = future
+        future.add_done_callback(lambda f: self._text_done(key))
+        return future
+
+    def _text_done(self, key):
+        with self._text_lock:
+            self._text_pending.pop(key, None)
+
+    @staticmethod
+    def _text_key(font_props, text):
+        return text, tuple(sorted(font_props.items()))
+
+    def _render_text(self, font_props, text):
+        # Imported here so printing from the CLI does not need ImageMagick
+        from wand.image import Image as WandImage
+        from wand.drawing import Drawing as WandDrawing
+        from wand.color import Color
+
+        with WandDrawing() as draw:
+            draw.font_family = font_props["family"]
+            draw.font_size = font_props["size"]
+            if font_props["slant"] == 'italic':
+                draw.font_style = 'italic'
+            if font_props["weight"] == 'bold':
+                draw.font_weight = 700
+            if font_props["underline"]:
+                draw.text_decoration = 'underline'
+            draw.text_kerning = font_props["kerning"]
+            draw.fill_color = Color('black')  # Set font color to black
+            draw.resolution = (TEXT_RENDER_DPI, TEXT_RENDER_DPI)
+            metrics = draw.get_font_metrics(WandImage(width=1, height=1), text, multiline=False)
+            text_width = int(metrics.text_width) + 5
+            text_height = int(metrics.text_height) + 5
+
+            with WandImage(width=text_width, height=text_height, background=Color('transparent')) as img:
+                draw.text(x=2, y=int(text_height / 2 + metrics.ascender / 2), body=text)
+                draw(img)
+                img.format = 'png'
+                img.alpha_channel = 'activate'  # Ensure alpha channel is active
+                img_blob = img.make_blob('png32')  # Use 'png32' for RGBA
+
+        image = Image.open(io.BytesIO(img_blob))
+        image.load()
+        return image
+
+    def label_size(self, document):
+        if document.get("size"):
+            width, height = document["size"]
+            return int(width), int(height)
+        dpi = document.get("dpi", self.dpi)
+        width_mm, height_mm = document["label_size"]
+        return mm_to_pixels(width_mm, dpi), mm_to_pixels(height_mm, dpi)
+
+    def text_bitmap(self, item):
+        if item.get("bitmap") is not None:
+            return item["bitmap"]
+        return self.render_text(item["font_props"], item["content"])
+
+    def image_bitmap(self, item):
+        if item.get("bitmap") is not None:
+            return item["bitmap"]
+        size = tuple(int(v) for v in item["size"]) if item.get("size") else None
+
+        def fit(path):
+            image = image_cache.open_image(path).convert("RGBA")
+            if size and image.size != size:
+                image = image.resize(size, Image.Resampling.LANCZOS)
+            return image
+
+        return image_cache.variant(item["path"], ("label", size), fit)
+
+    def compose(self, document, horizontal_offset=0, vertical_offset=0, margin=0, background=None):
+        """Compose the document into an RGBA image the size of the label plus ``margin`` on each side.
+
+        Offsets are in pixels and move the label window over the items, like the preview offsets in the GUI.
+        ``background`` must come from ``render_background`` with the same offsets and margin.
+        """
+        if background is None:
+            width, height = self.label_size(document)
+            label_image = Image.new("RGBA", (width + 2 * margin, height + 2 * margin), (255, 255, 255, 255))
+            self._compose_items(label_image, document, horizontal_offset - margin, vertical_offset - margin)
+        else:
+            label_image = background.copy()
+            self._compose_items(label_image, document, horizontal_offset - margin, vertical_offset - margin,
+                                static=False)
+        return label_image
+
+    def render_background(self, document, horizontal_offset=0, vertical_offset=0, margin=0):
+        """Compose only the static items, variable items are drawn over this layer by ``compose``."""
+        width, height = self.label_size(document)
+        label_image = Image.new("RGBA", (width + 2 * margin, height + 2 * margin), (255, 255, 255, 255))
+        self._compose_items(label_image, document, horizontal_offset - margin, vertical_offset - margin,
+                            static=True)
+        return label_image
+
+    def raster_source(self, document, background=None, dither="diffusion", threshold=128, rotate=0):
+        """``ImageSource`` of the document in print orientation, halftoned after rotating like the GUI does.
+
+        ``rotate`` is clockwise and added to the ``rotate`` of the document.
+        """
+        rotate = (int(document.get("rotate", 0)) + int(rotate)) % 360
+        return ImageSource(self.compose(document, background=background), rotate, dither, threshold)
+
+    def rasterize(self, document, background=None, dither="diffusion", threshold=128, rotate=0):
+        """Render the document into the 1-bit image that gets sent to the printer, see ``raster_source``."""
+        source = self.raster_source(document, background, dither, threshold, rotate)
+        mask = Image.new("1", (source.width, source.height))
+        for y, strip in source.strips():
+            mask.paste(strip, (0, y))
+        return ImageChops.invert(mask)
+
+    def _compose_items(self, label_image, document, origin_x, origin_y, static=None):
+        for item in document.get("image", []):
+            if static is None or is_static(item) == static:
+                self._paste(label_image, self.image_bitmap(item), item["coords"], origin_x, origin_y)
+        for item in document.get("text", []):
+            if static is None or is_static(item) == static:
+                self._paste(label_image, self.text_bitmap(item), item["coords"], origin_x, origin_y)
+
+    @staticmethod
+    def _paste(label_image, item_image, coords, origin_x, origin_y):
+        position = (int(coords[0] - origin_x), int(coords[1] - origin_y))
+        if item_image.mode != "RGBA":
+            item_image = item_image.convert("RGBA")
+        # Alpha is used as the paste mask so items are blended over what is already drawn
+        label_image.paste(item_image, position, item_image)
@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+import time
+
+from .logger_config import get_logger
+
+logger = get_logger()
+
+
+class LivenessMonitor:
+    """Keeps track of whether a printer is reachable without polling it while it is busy.
+
+    Every response from the printer counts as a sign of life, an explicit heartbeat is only sent once the
+    link was quiet for ``idle_interval`` seconds. While the printer cannot be reached the checks back off
+    exponentially up to ``max_interval``. ``on_state_change(connected, heartbeat)`` is called whenever
+    the state changes, ``on_heartbeat(heartbeat)`` for every heartbeat answer.
+    """
+
+    def __init__(self, printer, idle_interval=5.0, max_interval=60.0, on_state_change=None, on_heartbeat=None):
+        self.printer = printer
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.on_state_change = on_state_change
+        self.on_heartbeat = on_heartbeat
+        self.connected = None
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def _set_state(self, connected, heartbeat=None):
+        if connected != self.connected:
+            self.connected = connected
+            logger.info(f"Printer {'reachable' if connected else 'unreachable'}")
+            if self.on_state_change:
+                self.on_state_change(connected, heartbeat)
+
+    async def _run(self):
+        interval = self.idle_interval
+        while True:
+            idle = time.monotonic() - self.printer.last_response
+            if self.connected and idle < self.idle_interval:
+                # Real traffic proved the link is alive, check again once it has been quiet long enough
+                await asyncio.sleep(self.idle_interval - idle)
+                continue
+
+            try:
+                heartbeat = await self.printer.heartbeat()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+                self._set_state(False)
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_interval)
+                continue
+
+            interval = self.idle_interval
+            self._set_state(True, heartbeat)
+            if self.on_heartbeat:
+                self.on_heartbeat(heartbeat)
+            await asyncio.sleep(self.idle_interval)
@@ -1,10 +1,20 @@
+import struct
+
 from devtools import debug
 
+ROW_PACKET_TYPE = 0x85
+
 
 def packet_to_int(x):
     return int.from_bytes(x.data, "big")
 
 
+def row_packet(y, line_data):
+    counts = (0, 0, 0)  # It seems like you can always send zeros
+    header = struct.pack(">H3BB", y, *counts, 1)
+    return NiimbotPacket(ROW_PACKET_TYPE, header + line_data)
+
+
 class NiimbotPacket:
     def __init__(self, type_, data):
         self.type = type_
@@ -1,12 +1,15 @@
 import enum
 import asyncio
+import random
 import struct
-import math
-from PIL import Image, ImageOps
-from .exception import BLEException, PrinterException
+import time
+from collections import deque
+from bleak.exc import BleakError
+from .exception import BLEException, CommandTimeoutException, DisconnectedException, PrinterException
 from .bluetooth import BLETransport
 from .logger_config import get_logger
 from .packet import NiimbotPacket, packet_to_int
+from .scheduler import LinkScheduler, Priority
 
 from devtools import debug
 
@@ -42,24 +45,120 @@ class RequestCodeEnum(enum.IntEnum):
     GET_PRINT_STATUS = 163  # 0xA3
 
 
+RECONNECT_BASE_DELAY = 0.05  # seconds, the first attempt is made right away
+RECONNECT_MAX_DELAY = 2.0
+RECONNECT_TIMEOUT = 30.0
+DEFAULT_TIMEOUT = 10.0  # seconds, also the upper bound of the adaptive timeouts
+MIN_TIMEOUT = 0.5
+TIMEOUT_FACTOR = 4  # Times the p99 round trip
+RTT_SAMPLES = 64
+MIN_RTT_SAMPLES = 8  # Until then the default timeout is used
+COMMAND_RETRIES = 2
+MAX_PAGE_RESTARTS = 2
+IDEMPOTENT_REQUESTS = {RequestCodeEnum.GET_INFO, RequestCodeEnum.HEARTBEAT, RequestCodeEnum.GET_PRINT_STATUS}
+BACKGROUND_REQUESTS = {RequestCodeEnum.GET_INFO, RequestCodeEnum.GET_RFID, RequestCodeEnum.HEARTBEAT}
+# Errors a dropped link surfaces as, bleak raises its own errors (D-Bus ones included) next to ours
+LINK_ERRORS = (BLEException, BleakError, EOFError)
+ERROR_RESPONSE = 219  # 0xDB, sent instead of the answer when the printer rejects a request
+UNSUPPORTED_RESPONSE = 0  # 0x00, sent instead of the answer when the printer does not know a request
+# Packet type of the answer to each request, GET_INFO answers with the info key added, see response_type
+RESPONSE_TYPES = {
+    RequestCodeEnum.GET_RFID: 0x1B,
+    RequestCodeEnum.HEARTBEAT: 0xDD,
+    RequestCodeEnum.SET_LABEL_TYPE: 0x33,
+    RequestCodeEnum.SET_LABEL_DENSITY: 0x31,
+    RequestCodeEnum.START_PRINT: 0x02,
+    RequestCodeEnum.END_PRINT: 0xF4,
+    RequestCodeEnum.START_PAGE_PRINT: 0x04,
+    RequestCodeEnum.END_PAGE_PRINT: 0xE4,
+    RequestCodeEnum.ALLOW_PRINT_CLEAR: 0x30,
+    RequestCodeEnum.SET_DIMENSION: 0x14,
+    RequestCodeEnum.SET_QUANTITY: 0x16,
+    RequestCodeEnum.GET_PRINT_STATUS: 0xB3,
+}
+
+
+def response_type(request_code, data):
+    """Packet type the printer answers a request with."""
+    if request_code == RequestCodeEnum.GET_INFO:
+        return request_code + data[0]
+    return RESPONSE_TYPES[request_code]
+
+
+class JobOutcome(enum.Enum):
+    COMPLETED = "completed"
+    RESTARTED = "restarted"  # Completed after the page was sent again
+    ABANDONED = "abandoned"
+
+
+class RowPackets:
+    """Row packets that can be read again from the first row, a restarted page reads them again."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __iter__(self):
+        return iter(self.factory())
+
+
+class RoundTripTimes:
+    """Recent round trip times per request code, timeouts follow what the printer actually needs."""
+
+    def __init__(self):
+        self._samples = {}
+
+    def add(self, request_code, seconds):
+        self._samples.setdefault(request_code, deque(maxlen=RTT_SAMPLES)).append(seconds)
+
+    def timeout(self, request_code):
+        samples = self._samples.get(request_code)
+        if not samples or len(samples) < MIN_RTT_SAMPLES:
+            return DEFAULT_TIMEOUT
+        ordered = sorted(samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return min(max(p99 * TIMEOUT_FACTOR, MIN_TIMEOUT), DEFAULT_TIMEOUT)
+
+
 class PrinterClient:
     def __init__(self, device):
         self._characteristic = None
         self.device = device
         self.transport = BLETransport()
-        self.notification_event = asyncio.Event()
-        self.notification_data = None
-        self._ble_lock = asyncio.Lock()
+        self._link = LinkScheduler()
+        self._heartbeat_task = None
+        self._last_heartbeat = None
+        # Notifications stay subscribed for the whole connection, responses are handed to the
+        # (response type, future) entries here in the order the requests were written
+        self._notifying = False
+        self._pending = deque()
+        self.last_response = 0.0  # time.monotonic() of the last packet received from the printer
+        self.round_trips = RoundTripTimes()
+        self.last_row_sent = -1  # Row index of the current page the printer last accepted
+        # Settings the printer acknowledged on this connection, unchanged ones are not sent again
+        self._session = {}
+        self._media_state = None
+        # A dropped link is brought back in the background, see _on_disconnect
+        self._closing = False
+        self._reconnect_task = None
+        self.connection_id = 0  # Counts successful connects, a page is only valid on the connection it started on
+
+    def invalidate_session(self):
+        """Forget the acknowledged settings, the next job sends all of them again."""
+        self._session.clear()
 
     async def connect(self):
         logger.debug(f"PrinterClient.connect() called for device: {self.device.name} ({self.device.address})")
-        result = await self.transport.connect(self.device.address)
+        self.invalidate_session()
+        self._notifying = False
+        self._closing = False
+        result = await self.transport.connect(self.device.address, disconnected_callback=self._on_disconnect)
         if not result:
             logger.error(f"Connection failed to {self.device.name}")
             raise BLEException(f"Failed to connect to {self.device.name}")
         
         if not self._characteristic:
             await self._find_characteristics()
+        self.connection_id += 1
         logger.info(f"Successfully connected to {self.device.name}")
         return True
 
@@ -102,8 +201,61 @@ class PrinterClient:
             logger.error("No suitable characteristic found")
             raise PrinterException("Cannot find bluetooth characteristics.")
 
+    @property
+    def is_connected(self):
+        return bool(self.transport.client and self.transport.client.is_connected)
+
+    def _on_disconnect(self, client):
+        if client is not self.transport.client or client.is_connected:
+            # The link was already noticed as down and brought back, this belongs to the old connection
+            logger.debug(f"Ignoring a late disconnect of an earlier connection to {self.device.name}")
+            return
+        if self._closing:
+            self._connection_lost()
+            return
+        logger.warning(f"Connection to {self.device.name} dropped, reconnecting")
+        self._start_reconnect()
+
+    def _connection_lost(self):
+        self._notifying = False
+        self.invalidate_session()
+        # Requests still waiting will not get an answer on this connection
+        for entry in self._pending:
+            if not entry[1].done():
+                entry[1].set_exception(DisconnectedException(f"Lost connection to {self.device.name}"))
+        self._pending.clear()
+
+    def _start_reconnect(self):
+        """Start the reconnect task unless one is running, every reconnect goes through it."""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._connection_lost()
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+        return self._reconnect_task
+
+    async def _reconnect(self):
+        """Reconnect with jittered exponential backoff, the device address and handle are reused."""
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        attempt = 0
+        while not self._closing:
+            try:
+                await self.connect()
+                logger.info(f"Reconnected to {self.device.name} after {attempt + 1} attempt(s)")
+                return True
+            except Exception as e:
+                logger.debug(f"Reconnect attempt {attempt + 1} failed: {e}")
+            attempt += 1
+            delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+        logger.error(f"Could not reconnect to {self.device.name}")
+        return False
+
     async def disconnect(self):
         logger.debug(f"PrinterClient.disconnect() called for {self.device.name}")
+        self._closing = True
+        if self._reconnect_task and not self._reconnect_task.done():
+            self._reconnect_task.cancel()
         try:
             await self.transport.disconnect()
             logger.info(f"Printer {self.device.name} disconnected.")
@@ -112,119 +264,305 @@ class PrinterClient:
         except Exception as e:
             logger.warning(f"Disconnect error (may be already closed): {e}")
 
-    async def send_command(self, request_code, data, timeout=10):
-        async with self._ble_lock:
+    async def _ensure_connected(self):
+        if not self.is_connected and not self._closing:
+            # A failed write can notice the drop before the disconnect callback does
+            self._start_reconnect()
+        if self._reconnect_task and not self._reconnect_task.done():
+            logger.debug(f"Waiting for the connection to {self.device.name} to come back...")
+            if not await asyncio.shield(self._reconnect_task):
+                raise DisconnectedException(f"Lost connection to {self.device.name}")
+        if not self.is_connected:
+            # Only after an explicit disconnect, the connection is opened again here
+            logger.debug(f"send_command: client not connected, reconnecting...")
             try:
-                if not self.transport.client or not self.transport.client.is_connected:
-                    logger.debug(f"send_command: client not connected, reconnecting...")
-                    await self.connect()
-
-                packet = NiimbotPacket(request_code, data)
-                logger.trace(f"send_command: starting notification...")
-                await self.transport.start_notification(self._characteristic, self.notification_handler)
-
-                logger.trace(f"send_command: writing {len(packet.to_bytes())} bytes...")
-                await self.transport.write(packet.to_bytes(), self._characteristic)
+                await self.connect()
+            except PrinterException:
+                raise
+            except Exception as e:
+                raise DisconnectedException(f"Cannot connect to {self.device.name}: {e}") from e
+        if not self._notifying:
+            logger.trace(f"send_command: starting notification...")
+            await self.transport.start_notification(self._characteristic, self.notification_handler)
+            self._notifying = True
+
+    async def send_command(self, request_code, data, timeout=None):
+        responses = await self.send_commands([(request_code, data)], timeout)
+        return responses[0]
+
+    async def send_commands(self, requests, timeout=None, priority=None):
+        """Write (request code, data) pairs back to back, then wait for all responses.
+
+        Responses are matched to requests by their packet type. The printer handles requests in the order
+        they were written, but only requests that do not depend on the answer to an earlier one belong in
+        the same call. Requests that only query the printer go in the background lane unless ``priority``
+        says otherwise.
+
+        Without a ``timeout`` each request waits according to its observed round trip times. Unanswered
+        queries are sent again, a request that stays unanswered raises ``CommandTimeoutException``.
+        """
+        if priority is None:
+            background = all(request_code in BACKGROUND_REQUESTS for request_code, _ in requests)
+            priority = Priority.BACKGROUND if background else Priority.JOB
+
+        responses = [None] * len(requests)
+        remaining = list(range(len(requests)))
+        for attempt in range(COMMAND_RETRIES + 1):
+            answers = await self._send_once([requests[i] for i in remaining], timeout, priority)
+            for i, answer in zip(remaining, answers):
+                responses[i] = answer
+            remaining = [i for i in remaining if responses[i] is None]
+            if not remaining:
+                return responses
+            # Only queries are safe to send twice, a job step may already have been carried out
+            if any(requests[i][0] not in IDEMPOTENT_REQUESTS for i in remaining):
+                break
+            if attempt < COMMAND_RETRIES:
+                logger.warning(f"Retrying {', '.join(RequestCodeEnum(requests[i][0]).name for i in remaining)}")
 
-                logger.debug(f"Printer command sent - {RequestCodeEnum(request_code).name}")
-                await asyncio.wait_for(self.notification_event.wait(), timeout)
-                response = NiimbotPacket.from_bytes(self.notification_data)
+        self.invalidate_session()
+        names = ", ".join(RequestCodeEnum(requests[i][0]).name for i in remaining)
+        raise CommandTimeoutException(f"No response from {self.device.name} to {names}")
 
-                logger.trace(f"send_command: stopping notification...")
-                await self.transport.stop_notification(self._characteristic)
-                self.notification_event.clear()
-                return response
-            except asyncio.TimeoutError:
-                logger.error(f"Timeout occurred for request {RequestCodeEnum(request_code).name}")
-                try:
-                    await self.transport.stop_notification(self._characteristic)
-                except Exception:
-                    pass
-                self.notification_event.clear()
+    async def _send_once(self, requests, timeout, priority):
+        """Send the requests once, unanswered ones are returned as None."""
+        async with self._link.acquire(priority):
+            entries = []
+            try:
+                await self._ensure_connected()
+                loop = asyncio.get_running_loop()
+                for request_code, data in requests:
+                    # (response type, future, request code, time sent), see notification_handler
+                    entry = (response_type(request_code, data), loop.create_future(), request_code, time.monotonic())
+                    self._pending.append(entry)
+                    entries.append(entry)
+                    packet = NiimbotPacket(request_code, data)
+                    logger.trace(f"send_command: writing {len(packet.to_bytes())} bytes...")
+                    await self.transport.write(packet.to_bytes(), self._characteristic)
+                    logger.debug(f"Printer command sent - {RequestCodeEnum(request_code).name}")
+
+                if timeout is None:
+                    timeout = max(self.round_trips.timeout(request_code) for request_code, _ in requests)
+                await asyncio.wait([entry[1] for entry in entries], timeout=timeout)
+                responses = []
+                for request_code, future in ((entry[2], entry[1]) for entry in entries):
+                    if not future.done():
+                        logger.error(f"Timeout occurred for request {RequestCodeEnum(request_code).name}")
+                        responses.append(None)
+                    elif future.exception():
+                        # A rejected request may have been a setting, the printer's state is no longer known
+                        self.invalidate_session()
+                        raise future.exception()
+                    else:
+                        responses.append(future.result())
+                return responses
             except ValueError as e:
                 if 'None' in str(e):
                     logger.error(f"UUID parsing error in send_command: {e}")
-                else:
-                    raise
-            except BLEException as e:
+                    raise PrinterException(f"Cannot talk to {self.device.name}: {e}")
+                raise
+            except DisconnectedException:
+                self.invalidate_session()
+                raise
+            except LINK_ERRORS as e:
                 logger.error(f"An error occurred: {e}")
-
-    async def write_raw(self, data):
-        async with self._ble_lock:
+                self.invalidate_session()
+                raise DisconnectedException(f"Cannot talk to {self.device.name}: {e}") from e
+            finally:
+                for entry in entries:
+                    if entry in self._pending:
+                        self._pending.remove(entry)
+                        entry[1].cancel()
+
+    async def write_raw(self, data, connection_id=None):
+        """Write a packet without waiting for an answer.
+
+        With a ``connection_id`` the write fails with ``DisconnectedException`` once the link was
+        reconnected since, the printer has forgotten the page the packet belongs to.
+        """
+        async with self._link.acquire(Priority.JOB):
             try:
-                if not self.transport.client or not self.transport.client.is_connected:
-                    await self.connect()
+                await self._ensure_connected()
+                self._check_connection(connection_id)
                 await self.transport.write(data.to_bytes(), self._characteristic)
-            except BLEException as e:
+            except DisconnectedException:
+                raise
+            except LINK_ERRORS as e:
+                # A row that did not go out leaves a hole in the page, the page has to be sent again
                 logger.error(f"An error occurred: {e}")
+                raise DisconnectedException(f"Cannot write to {self.device.name}: {e}") from e
+
+    def _check_connection(self, connection_id):
+        if connection_id is not None and connection_id != self.connection_id:
+            raise DisconnectedException(f"Reconnected to {self.device.name} while a page was being sent")
 
     async def write_no_notify(self, request_code, data):
-        async with self._ble_lock:
+        async with self._link.acquire(Priority.JOB):
             try:
-                if not self.transport.client or not self.transport.client.is_connected:
-                    await self.connect()
+                await self._ensure_connected()
                 packet = NiimbotPacket(request_code, data)
                 await self.transport.write(packet.to_bytes(), self._characteristic)
-            except BLEException as e:
+            except DisconnectedException:
+                raise
+            except LINK_ERRORS as e:
                 logger.error(f"An error occurred: {e}")
 
     def notification_handler(self, sender, data):
         # print(f"Notification from {sender}: {data}")
         logger.trace(f"Notification: {data}")
-        self.notification_data = data
-        self.notification_event.set()
-
-    async def print_image(self, image: Image, density: int = 3, quantity: int = 1, vertical_offset= 0,
-                          horizontal_offset = 0):
-        await self.set_label_density(density)
-        await self.set_label_type(1)
-        await self.start_print()
-        await self.start_page_print()
-        await self.set_dimension(image.height, image.width)
-        await self.set_quantity(quantity)
-
-        for pkt in self._encode_image(image, vertical_offset, horizontal_offset):
+        try:
+            packet = NiimbotPacket.from_bytes(data)
+        except AssertionError:
+            logger.warning(f"Dropping malformed notification: {data}")
+            return
+        self.last_response = time.monotonic()
+        for entry in self._pending:
+            # An error does not name the request it belongs to, it answers the oldest one
+            if entry[0] == packet.type or packet.type in (ERROR_RESPONSE, UNSUPPORTED_RESPONSE):
+                self._pending.remove(entry)
+                if not entry[1].done():
+                    if packet.type == ERROR_RESPONSE:
+                        entry[1].set_exception(PrinterException(f"Printer rejected the request: {packet.data}"))
+                    elif packet.type == UNSUPPORTED_RESPONSE:
+                        entry[1].set_exception(PrinterException(
+                            f"Printer does not support {RequestCodeEnum(entry[2]).name}"))
+                    else:
+                        self.round_trips.add(entry[2], self.last_response - entry[3])
+                        entry[1].set_result(packet)
+                return
+        logger.trace(f"Notification of type {packet.type} does not answer any request")
+
+    async def print_image(self, image, density: int = 3, quantity: int = 1, vertical_offset= 0,
+                          horizontal_offset = 0, dither="diffusion", threshold=128, rotate=0, on_progress=None):
+        from .raster import ImageSource
+
+        source = ImageSource(image, rotate, dither, threshold)
+        return await self.print_source(source, density, quantity, vertical_offset, horizontal_offset, on_progress)
+
+    async def print_source(self, source, density: int = 3, quantity: int = 1, vertical_offset=0,
+                           horizontal_offset=0, on_progress=None):
+        """Print a ``RasterSource``, rows are encoded while they are sent."""
+        from .raster import encode_source
+
+        packets = RowPackets(lambda: encode_source(source, vertical_offset, horizontal_offset))
+        return await self.print_packets(packets, source.width, source.height, density=density, quantity=quantity,
+                                        rows=max(source.height + vertical_offset, 0), on_progress=on_progress)
+
+    async def print_job(self, job, quantity=None, on_progress=None):
+        """Print an already encoded ``PrintJob``, ``quantity`` overrides the one stored in the job."""
+        return await self.print_packets(RowPackets(job.packets), job.width, job.height, density=job.density,
+                                        quantity=quantity or job.quantity, rows=job.rows, on_progress=on_progress)
+
+    async def print_packets(self, packets, width, height, density: int = 3, quantity: int = 1, rows=None,
+                            on_progress=None):
+        """Print a page from already encoded row packets, see ``encode_image``.
+
+        If the link drops before the page was handed over, the page is sent again once the connection is
+        back. ``packets`` that can be iterated again, such as ``RowPackets``, are read again from the
+        start, the rows of a one-shot iterator are kept while they are sent. Returns the ``JobOutcome``.
+
+        ``on_progress`` is called with a dict for every row sent and every status poll. ``stage`` is
+        "sending" or "printing" and then the outcome, next to ``rows_sent``, ``rows_total`` (``rows``,
+        defaults to the height), ``bytes_per_second``, ``pages_done`` and ``pages_total``.
+        """
+        progress = {"stage": "sending", "rows_sent": 0, "rows_total": height if rows is None else rows,
+                    "bytes_per_second": 0.0, "pages_done": 0, "pages_total": quantity}
+
+        def report(**changes):
+            progress.update(changes)
+            if on_progress:
+                on_progress(dict(progress))
+
+        async with self._link.job():
+            outcome = await self._print_packets(packets, width, height, density, quantity, report)
+        report(stage=outcome.value)
+        return outcome
+
+    async def _print_packets(self, packets, width, height, density, quantity, report):
+        assert 1 <= density <= 5
+        if iter(packets) is packets:
+            # A one-shot iterator cannot be read twice, its rows are kept for a restarted page
+            rows = []
+            page_rows = lambda: self._page_rows(rows, packets)
+        else:
+            page_rows = lambda: iter(packets)
+        restarts = 0
+        while True:
+            try:
+                await self._send_page(page_rows(), width, height, density, quantity, report)
+                break
+            except DisconnectedException as e:
+                if restarts == MAX_PAGE_RESTARTS:
+                    logger.error(f"Abandoning the page after {restarts} restarts: {e}")
+                    return JobOutcome.ABANDONED
+                restarts += 1
+                logger.warning(f"Link lost after row {self.last_row_sent}, restarting the page "
+                               f"({restarts}/{MAX_PAGE_RESTARTS})")
+
+        try:
+            while True:
+                status = await self.get_print_status()
+                report(stage="printing", pages_done=status['page'])
+                if status['page'] == quantity:
+                    break
+                await asyncio.sleep(0.1)
+
+            await self.end_print()
+        except DisconnectedException as e:
+            # The printer already has the whole page, sending it again would print it twice
+            logger.warning(f"Link lost while the page was printing: {e}")
+        return JobOutcome.RESTARTED if restarts else JobOutcome.COMPLETED
+
+    async def _send_page(self, rows, width, height, density, quantity, report):
+        # The settings and START_PRINT go out together, the page is only set up once the job started
+        settings = self._unsent_settings([(RequestCodeEnum.SET_LABEL_DENSITY, bytes((density,))),
+                                          (RequestCodeEnum.SET_LABEL_TYPE, bytes((1,)))])
+        responses = await self.send_commands(settings + [(RequestCodeEnum.START_PRINT, b"\x01")])
+        # A reconnect from here on drops the page on the printer, every later step checks for it
+        connection_id = self.connection_id
+        for (request_code, data), packet in zip(settings, responses):
+            self._remember_setting(request_code, data, packet)
+        await self.send_commands([(RequestCodeEnum.START_PAGE_PRINT, b"\x01"),
+                                  (RequestCodeEnum.SET_DIMENSION, struct.pack(">HH", height, width)),
+                                  (RequestCodeEnum.SET_QUANTITY, struct.pack(">H", quantity))])
+        self._check_connection(connection_id)
+
+        self.last_row_sent = -1
+        started = time.monotonic()
+        bytes_sent = 0
+        report(stage="sending", rows_sent=0, bytes_per_second=0.0)
+        for index, pkt in enumerate(rows):
             # Send each line and wait for a response or status check
-            await self.write_raw(pkt)
+            await self.write_raw(pkt, connection_id)
+            self.last_row_sent = index
+            bytes_sent += len(pkt.data) + 7  # Packet framing adds seven bytes
+            report(rows_sent=index + 1, bytes_per_second=bytes_sent / max(time.monotonic() - started, 1e-3))
             # Adding a short delay or status check here can help manage buffer issues
             await asyncio.sleep(0.01)  # Adjust the delay as needed based on printer feedback
 
         while not await self.end_page_print():
             await asyncio.sleep(0.05)
-
-        while True:
-            status = await self.get_print_status()
-            if status['page'] == quantity:
-                break
-            await asyncio.sleep(0.1)
-
-        await self.end_print()
-
-    def _encode_image(self, image: Image, vertical_offset=0, horizontal_offset=0):
-        # Convert the image to monochrome
-        img = ImageOps.invert(image.convert("L")).convert("1")
-
-        # Apply horizontal offset
-        if horizontal_offset > 0:
-            img = ImageOps.expand(img, border=(horizontal_offset, 0, 0, 0), fill=1)
-        else:
-            img = img.crop((-horizontal_offset, 0, img.width, img.height))
-
-        # Add vertical padding for vertical offset
-        img = ImageOps.expand(img, border=(0, vertical_offset, 0, 0), fill=1)
-
-        for y in range(img.height):
-            line_data = [img.getpixel((x, y)) for x in range(img.width)]
-            line_data = "".join("0" if pix == 0 else "1" for pix in line_data)
-            line_data = int(line_data, 2).to_bytes(math.ceil(img.width / 8), "big")
-            counts = (0, 0, 0)  # It seems like you can always send zeros
-            header = struct.pack(">H3BB", y, *counts, 1)
-            pkt = NiimbotPacket(0x85, header + line_data)
+        self._check_connection(connection_id)
+
+    @staticmethod
+    def _page_rows(rows, packets):
+        # Rows taken in an earlier attempt first, then the rest of the iterator
+        yield from list(rows)
+        for pkt in packets:
+            rows.append(pkt)
             yield pkt
 
     async def get_info(self, key):
         response = await self.send_command(RequestCodeEnum.GET_INFO, bytes((key,)))
+        return self._decode_info(key, response)
+
+    async def get_infos(self, keys):
+        """Query several info keys with a single round trip."""
+        responses = await self.send_commands([(RequestCodeEnum.GET_INFO, bytes((key,))) for key in keys])
+        return [self._decode_info(key, response) for key, response in zip(keys, responses)]
 
+    @staticmethod
+    def _decode_info(key, response):
         match key:
             case InfoEnum.DEVICESERIAL:
                 return response.data.hex()
@@ -267,6 +605,17 @@ class PrinterClient:
         }
 
     async def heartbeat(self):
+        """Heartbeat state, concurrent callers share one request.
+
+        During a print job the last known state is returned, heartbeats never wait for the link then.
+        """
+        if self._link.job_active and self._last_heartbeat is not None:
+            return self._last_heartbeat
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+        return await asyncio.shield(self._heartbeat_task)
+
+    async def _heartbeat(self):
         packet = await self.send_command(RequestCodeEnum.HEARTBEAT, b"\x01")
         closing_state = None
         power_level = None
@@ -294,22 +643,50 @@ class PrinterClient:
             case 9:
                 closing_state = packet.data[8]
 
-        return {
+        # Opening the lid or changing the paper may reset the printer's settings
+        media_state = (closing_state, paper_state)
+        if self._media_state is not None and media_state != self._media_state:
+            logger.debug("Lid or paper state changed, printer settings will be sent again")
+            self.invalidate_session()
+        self._media_state = media_state
+
+        self._last_heartbeat = {
             "closing_state": closing_state,
             "power_level": power_level,
             "paper_state": paper_state,
             "rfid_read_state": rfid_read_state,
         }
+        return self._last_heartbeat
+
+    def _unsent_settings(self, settings):
+        unsent = []
+        for request_code, data in settings:
+            if self._session.get(request_code) == data:
+                logger.debug(f"Skipping {RequestCodeEnum(request_code).name}, already set on this connection")
+            else:
+                unsent.append((request_code, data))
+        return unsent
+
+    def _remember_setting(self, request_code, data, packet):
+        if packet is not None and packet.data[0]:
+            self._session[request_code] = data
+        else:
+            self._session.pop(request_code, None)
+
+    async def _send_setting(self, request_code, data):
+        if not self._unsent_settings([(request_code, data)]):
+            return True
+        packet = await self.send_command(request_code, data)
+        self._remember_setting(request_code, data, packet)
+        return bool(packet.data[0])
 
     async def set_label_type(self, n):
         assert 1 <= n <= 3
-        packet = await self.send_command(RequestCodeEnum.SET_LABEL_TYPE, bytes((n,)))
-        return bool(packet.data[0])
+        return await self._send_setting(RequestCodeEnum.SET_LABEL_TYPE, bytes((n,)))
 
     async def set_label_density(self, n):
         assert 1 <= n <= 5  # B21 has 5 levels, not sure for D11
-        packet = await self.send_command(RequestCodeEnum.SET_LABEL_DENSITY, bytes((n,)))
-        return bool(packet.data[0])
+        return await self._send_setting(RequestCodeEnum.SET_LABEL_DENSITY, bytes((n,)))
 
     async def start_print(self):
         packet = await self.send_command(RequestCodeEnum.START_PRINT, b"\x01")
@@ -0,0 +1,221 @@
+import mmap
+
+from PIL import Image, ImageChops, ImageOps
+
+from .packet import row_packet
+
+DITHER_MODES = ("diffusion", "threshold", "ordered")
+STRIP_HEIGHT = 128  # Rows converted at a time, memory use does not grow with the label length
+
+# 8x8 Bayer index matrix, scaled to thresholds in the middle of each of the 64 levels
+_BAYER_8X8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+_BAYER_THRESHOLDS = tuple(tuple(v * 4 + 2 for v in row) for row in _BAYER_8X8)
+
+
+def _threshold_map(width, height, y_offset=0):
+    size = len(_BAYER_THRESHOLDS)
+    rows = [bytes(row[x % size] for x in range(width)) for row in _BAYER_THRESHOLDS]
+    data = b"".join(rows[(y + y_offset) % size] for y in range(height))
+    return Image.frombytes("L", (width, height), data)
+
+
+def halftone(image, mode="diffusion", threshold=128, y_offset=0):
+    """Convert an image to a 1-bit ink mask, set pixels are printed black.
+
+    ``diffusion`` is Floyd-Steinberg error diffusion (the Pillow default), ``threshold`` prints every
+    pixel darker than ``threshold`` and ``ordered`` uses an 8x8 Bayer matrix. The last two work per
+    pixel through lookup tables and are deterministic, ``y_offset`` keeps the Bayer pattern aligned
+    when an image is processed in strips.
+    """
+    gray = image.convert("L")
+    match mode:
+        case "diffusion":
+            return ImageOps.invert(gray).convert("1")
+        case "threshold":
+            lut = [255 if v < threshold else 0 for v in range(256)]
+            return gray.point(lut, "1")
+        case "ordered":
+            # (map - gray) + 128 is above 128 exactly where the pixel is darker than its threshold
+            difference = ImageChops.subtract(_threshold_map(gray.width, gray.height, y_offset), gray, 1.0, 128)
+            return difference.point([255 if v > 128 else 0 for v in range(256)], "1")
+        case _:
+            raise ValueError(f"Unknown dither mode {mode}, expected one of {', '.join(DITHER_MODES)}")
+
+
+class RasterSource:
+    """Ink mask of a label in print orientation, read one strip of rows at a time.
+
+    ``rotate`` is clockwise. Rotated sources read column strips of the original so the full rotated
+    image is never built, subclasses only have to return a region of the unrotated source.
+    """
+
+    def __init__(self, size, rotate=0):
+        if rotate not in (0, 90, 180, 270):
+            raise ValueError(f"Unsupported rotation {rotate}, expected 0, 90, 180 or 270")
+        self.rotate = rotate
+        self.source_width, self.source_height = size
+        self.width, self.height = size if rotate in (0, 180) else (size[1], size[0])
+
+    def _read(self, box):
+        raise NotImplementedError
+
+    def _mask(self, strip, y):
+        return strip
+
+    def _source_box(self, y, rows):
+        w, h = self.source_width, self.source_height
+        match self.rotate:
+            case 90:
+                return (y, 0, y + rows, h), Image.Transpose.ROTATE_270
+            case 180:
+                return (0, h - y - rows, w, h - y), Image.Transpose.ROTATE_180
+            case 270:
+                return (w - y - rows, 0, w - y, h), Image.Transpose.ROTATE_90
+            case _:
+                return (0, y, w, y + rows), None
+
+    def strips(self, strip_height=STRIP_HEIGHT):
+        """Yield (first row, "1" strip) pairs from top to bottom, set pixels are printed."""
+        for y in range(0, self.height, strip_height):
+            box, transpose = self._source_box(y, min(strip_height, self.height - y))
+            strip = self._read(box)
+            if transpose is not None:
+                strip = strip.transpose(transpose)
+            yield y, self._mask(strip, y)
+
+
+class ImageSource(RasterSource):
+    """Strips of a PIL image, halftoned strip by strip.
+
+    Error diffusion carries the error down the whole page, so for ``diffusion`` the page is halftoned in
+    one go and strips are cut from the 1-bit result.
+    """
+
+    def __init__(self, image, rotate=0, dither="diffusion", threshold=128):
+        super().__init__(image.size, rotate)
+        self.image = image
+        self.dither = dither
+        self.threshold = threshold
+
+    def _read(self, box):
+        return self.image.crop(box)
+
+    def _mask(self, strip, y):
+        return halftone(strip, self.dither, self.threshold, y_offset=y)
+
+    def strips(self, strip_height=STRIP_HEIGHT):
+        if self.dither != "diffusion":
+            yield from super().strips(strip_height)
+            return
+        mask = self._diffused_mask()
+        for y in range(0, self.height, strip_height):
+            yield y, mask.crop((0, y, self.width, min(y + strip_height, self.height)))
+
+    def _diffused_mask(self):
+        # Only the grayscale page is rotated, one byte per pixel and released once it is halftoned
+        gray = self.image.convert("L")
+        _, transpose = self._source_box(0, self.height)
+        if transpose is not None:
+            gray = gray.transpose(transpose)
+        return halftone(gray, "diffusion")
+
+
+class PBMSource(RasterSource):
+    """Strips of a binary (P4) PBM file, memory mapped so only the rows being encoded are paged in.
+
+    PBM stores one bit per pixel with 1 for black, which already is the printer's row format.
+    """
+
+    def __init__(self, path, rotate=0):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            size, self._data_offset = _read_pbm_header(self._map)
+        except Exception:
+            self._file.close()
+            raise
+        super().__init__(size, rotate)
+        self._stride = (self.source_width + 7) // 8
+        if self._data_offset + self._stride * self.source_height > len(self._map):
+            self.close()
+            raise ValueError(f"PBM file {path} is truncated")
+
+    def _read(self, box):
+        x0, y0, x1, y1 = box
+        first_byte, last_byte = x0 // 8, (x1 + 7) // 8
+        start = self._data_offset + y0 * self._stride
+        if first_byte == 0 and last_byte == self._stride:
+            data = self._map[start:start + (y1 - y0) * self._stride]
+        else:
+            data = b"".join(self._map[start + row * self._stride + first_byte:start + row * self._stride + last_byte]
+                            for row in range(y1 - y0))
+        strip = Image.frombytes("1", ((last_byte - first_byte) * 8, y1 - y0), data)
+        return strip.crop((x0 - first_byte * 8, 0, x1 - first_byte * 8, y1 - y0))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _read_pbm_header(data):
+    if data[:2] != b"P4":
+        raise ValueError("Only binary (P4) PBM files are supported")
+    values = []
+    pos = 2
+    while len(values) < 2:
+        char = data[pos:pos + 1]
+        if not char:
+            raise ValueError("PBM header is truncated")
+        if char == b"#":
+            pos = data.find(b"\n", pos) + 1 or len(data)
+        elif char.isspace():
+            pos += 1
+        else:
+            end = pos
+            while data[end:end + 1].isdigit():
+                end += 1
+            if end == pos:
+                raise ValueError("PBM header is malformed")
+            values.append(int(data[pos:end]))
+            pos = end
+    # Exactly one whitespace character separates the header from the pixel data
+    return (values[0], values[1]), pos + 1
+
+
+def encode_image(image, vertical_offset=0, horizontal_offset=0, dither="diffusion", threshold=128, rotate=0):
+    """Yield the row packets for an image, this does not need a printer connection."""
+    return encode_source(ImageSource(image, rotate, dither, threshold), vertical_offset, horizontal_offset)
+
+
+def encode_source(source, vertical_offset=0, horizontal_offset=0, strip_height=STRIP_HEIGHT):
+    """Yield the row packets for a ``RasterSource``, only one strip of rows is in memory at a time."""
+    width = max(source.width + horizontal_offset, 0)
+    # Rows are sent right aligned, blank columns on the left fill up the last byte
+    pad = (-width) % 8
+    stride = (width + pad) // 8
+
+    # Positive offsets add blank rows on top, negative ones drop rows
+    for y in range(vertical_offset):
+        yield row_packet(y, bytes(stride))
+
+    for top, strip in source.strips(strip_height):
+        if pad or horizontal_offset:
+            row = Image.new("1", (width + pad, strip.height), 0)
+            # Columns moved past the left edge are cropped, they must not end up in the padding bits
+            row.paste(strip.crop((max(-horizontal_offset, 0), 0, strip.width, strip.height)),
+                      (pad + max(horizontal_offset, 0), 0))
+            strip = row
+        data = strip.tobytes()
+        for i in range(strip.height):
+            y = vertical_offset + top + i
+            if y >= 0:
+                yield row_packet(y, data[i * stride:(i + 1) * stride])
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import enum
+import heapq
+import itertools
+
+
+class Priority(enum.IntEnum):
+    JOB = 0  # Raster rows and job control
+    BACKGROUND = 1  # Heartbeats and info queries
+
+
+class LinkScheduler:
+    """Hands the BLE link to one request at a time, highest priority first and in arrival order within a lane.
+
+    While a job is active background requests are held back until it finished, they never get the link in
+    the short gaps between two rows.
+    """
+
+    def __init__(self):
+        self._busy = False
+        self._waiters = []  # Heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._jobs = 0
+
+    @property
+    def job_active(self):
+        return self._jobs > 0
+
+    @contextlib.asynccontextmanager
+    async def job(self):
+        """Mark a print job as running for as long as the block runs."""
+        self._jobs += 1
+        try:
+            yield
+        finally:
+            self._jobs -= 1
+            self._wake()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, priority=Priority.JOB):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled right after being handed the link, pass it on to the next waiter
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self._busy = False
+        self._wake()
+
+    def _wake(self):
+        while not self._busy and self._waiters:
+            priority, _, future = self._waiters[0]
+            if priority != Priority.JOB and self.job_active:
+                return
+            heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._busy = True
+            future.set_result(None)
@@ -1,6 +1,10 @@
 import os
 import appdirs
 import platform
+
+from NiimPrintX.nimmy.label import LabelRenderer
+
+
 class AppConfig:
     def __init__(self):
         self.os_system = platform.system()
@@ -57,8 +61,8 @@ class AppConfig:
         }
         self.current_label_size = None
         self.frames = {}
-        self.print_job = False
         self.printer_connected = False
         self.cache_dir = appdirs.user_cache_dir('NiimPrintX')
+        self.label_renderer = LabelRenderer(self.print_dpi)
 
 
@@ -0,0 +1,129 @@
+import base64
+import io
+import json
+import os
+import pickle
+import zipfile
+
+from PIL import Image
+
+from NiimPrintX.nimmy.imagecache import image_cache
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 2
+# Old projects are pickled dicts of plain values, no other globals may be loaded from them
+LEGACY_SAFE_BUILTINS = {"dict", "list", "tuple", "str", "bytes", "int", "float", "bool"}
+
+
+class ProjectAssets:
+    """Assets of an opened .niim file.
+
+    Loading a project decodes every asset up front, items are drawn right away. Assets with the same
+    hash share one decoded image through the image cache.
+    """
+
+    def __init__(self, file_path):
+        self.zip_file = zipfile.ZipFile(file_path, "r")
+
+    def image(self, asset_hash):
+        # Assets are content addressed, an asset decoded for any earlier file is reused as is
+        return image_cache.get_or_create(("asset", asset_hash), lambda: self._decode(asset_hash))
+
+    def _decode(self, asset_hash):
+        with self.zip_file.open(f"assets/{asset_hash}.png") as f:
+            image = Image.open(f)
+            image.load()
+        return image
+
+    def close(self):
+        self.zip_file.close()
+
+
+class ProjectWriter:
+    """Collect assets by content hash so every distinct image is written once."""
+
+    def __init__(self):
+        self.assets = {}
+
+    def add_image(self, image):
+        # Images are shared through the image cache, so one that was saved before is not encoded again
+        asset_hash, data = image_cache.encoded_png(image)
+        self.assets.setdefault(asset_hash, data)
+        return asset_hash
+
+    def write(self, file_path, manifest):
+        manifest = dict(manifest, format="niim", version=FORMAT_VERSION)
+        with zipfile.ZipFile(file_path, "w") as zf:
+            zf.writestr(MANIFEST_NAME, json.dumps(manifest), compress_type=zipfile.ZIP_DEFLATED)
+            for asset_hash, data in self.assets.items():
+                # PNG data is already compressed
+                zf.writestr(f"assets/{asset_hash}.png", data, compress_type=zipfile.ZIP_STORED)
+
+
+def is_project_file(file_path):
+    return zipfile.is_zipfile(file_path)
+
+
+def load_project(file_path):
+    """Return the manifest and the asset store, the caller closes the store once its items are loaded."""
+    assets = ProjectAssets(file_path)
+    try:
+        manifest = json.loads(assets.zip_file.read(MANIFEST_NAME))
+    except Exception:
+        assets.close()
+        raise
+    return manifest, assets
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "builtins" and name in LEGACY_SAFE_BUILTINS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a project file")
+
+
+def _decode_base64_png(data):
+    image = Image.open(io.BytesIO(base64.b64decode(data)))
+    image.load()
+    return image
+
+
+def migrate_legacy_project(file_path):
+    """Convert a project saved in the old pickle format to the current format in place.
+
+    The old file is kept next to it with a ``.bak`` suffix, returns the backup path.
+    """
+    with open(file_path, "rb") as f:
+        data = _LegacyUnpickler(f).load()
+    if not isinstance(data, dict):
+        raise ValueError("Not a NiimPrintX project file")
+
+    writer = ProjectWriter()
+    manifest = {
+        "device": data["device"],
+        "current_label_size": data["current_label_size"],
+        "text": [],
+        "image": []
+    }
+    # Rendered text was stored as well, it is rendered again from the font properties now
+    for item in (data.get("text") or {}).values():
+        manifest["text"].append({
+            "content": item["content"],
+            "coords": item["coords"],
+            "font_props": item["font_props"]
+        })
+    for item in (data.get("image") or {}).values():
+        manifest["image"].append({
+            "original_image": writer.add_image(_decode_base64_png(item["original_image"])),
+            "size": list(_decode_base64_png(item["image"]).size),
+            "coords": item["coords"]
+        })
+
+    backup_path = f"{file_path}.bak"
+    os.replace(file_path, backup_path)
+    try:
+        writer.write(file_path, manifest)
+    except BaseException:
+        os.replace(backup_path, file_path)
+        raise
+    return backup_path
@@ -1,13 +1,18 @@
-import base64
-import io
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog, font
-import pickle
 from PIL import Image, ImageTk
 
-from devtools import debug
+from ..component.ProjectFile import ProjectWriter, load_project, is_project_file, migrate_legacy_project
+from NiimPrintX.nimmy.label import TEXT_RENDER_DPI
+from NiimPrintX.nimmy.logger_config import get_logger
+
+logger = get_logger()
+
+TEXT_RENDER_POLL_MS = 30
+
+
 class FileMenu:
     def __init__(self, root, parent, config):
         self.root = root
@@ -28,60 +33,52 @@ class FileMenu:
             self.root.quit()
 
     def save_to_file(self):
+        writer = ProjectWriter()
         data = {
             "device": self.config.device,
             "current_label_size": self.config.current_label_size,
-            "text": {},
-            "image": {}
+            "text": [],
+            "image": []
         }
         if self.config.text_items:
-            debug(self.config.text_items)
             for text_id, properties in self.config.text_items.items():
-                font_image = ImageTk.getimage(properties["font_image"])
-                with io.BytesIO() as buffer:
-                    font_image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    font_img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
+                # Text is rendered again from its properties on load, no bitmap is stored
                 item_data = {
                     "content": properties["content"],
                     "coords": self.config.canvas.coords(text_id),
-                    "font_props": properties['font_props'],
-                    "font_image": font_img_str
+                    "font_props": properties['font_props']
                 }
-                data['text'][str(text_id)] = item_data
+                data['text'].append(item_data)
 
         if self.config.image_items:
             for image_id, properties in self.config.image_items.items():
-                resized_image = ImageTk.getimage(properties["image"])
-                with io.BytesIO() as buffer:
-                    resized_image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    resize_img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-                with io.BytesIO() as buffer:
-                    properties["original_image"].save(buffer, format="PNG")
-                    buffer.seek(0)
-                    original_img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
+                # Only the original is stored, the displayed image is resized from it on load
                 item_data = {
-                    "image": resize_img_str,
-                    "original_image": original_img_str,
+                    "original_image": writer.add_image(properties["original_image"]),
+                    "size": [properties["image"].width(), properties["image"].height()],
                     "coords": self.config.canvas.coords(image_id)
                 }
-                data['image'][str(image_id)] = item_data
+                data['image'].append(item_data)
 
         file_path = filedialog.asksaveasfilename(defaultextension=".niim",
                                                  filetypes=[("NIIM files", "*.niim")])
         if file_path:
-            with open(file_path, 'wb') as f:
-                pickle.dump(data, f)
+            writer.write(file_path, data)
 
     def load_from_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("NIIM files", "*.niim")])
         if file_path:
-            with open(file_path, 'rb') as f:
-                data = pickle.load(f)
+            if not is_project_file(file_path):
+                try:
+                    backup_path = migrate_legacy_project(file_path)
+                except Exception as e:
+                    logger.error(f"Cannot convert project {file_path}: {e}")
+                    messagebox.showerror("Error", "This file is not a NiimPrintX project or it is damaged.")
+                    return
+                messagebox.showinfo("Project converted",
+                                    f"This project was saved in an older format and has been converted. "
+                                    f"The original file was kept as {backup_path}.")
+            data, assets = load_project(file_path)
 
             self.root.canvas_selector.selected_device.set(data["device"].upper())
             self.root.canvas_selector.selected_label_size.set(data["current_label_size"])
@@ -90,18 +87,22 @@ class FileMenu:
             self.config.text_items = {}
             self.config.image_items = {}
 
-            if data["text"]:
-                for text_id, item_data in data["text"].items():
-                    self.load_text(item_data)
+            pending_renders = []
+            try:
+                for item_data in data["text"]:
+                    pending_renders.append(self.load_text(item_data))
 
-            if data["image"]:
-                for image_id, item_data in data["image"].items():
-                    self.load_image(item_data)
+                for item_data in data["image"]:
+                    self.load_image(item_data, assets)
+            finally:
+                assets.close()
+            canvas = self.config.canvas
+            self.root.after(TEXT_RENDER_POLL_MS, lambda: self.update_text_renders(canvas, pending_renders))
 
     def load_text(self, data):
-        font_img_data = base64.b64decode(data["font_image"])
-        font_image = Image.open(io.BytesIO(font_img_data))
-        font_img_tk = ImageTk.PhotoImage(font_image)
+        # Show a placeholder while the text is rendered off the UI thread
+        font_img_tk = self.text_placeholder(data["font_props"], data["content"])
+        future = self.config.label_renderer.render_text_async(data["font_props"], data["content"])
         text_id = self.config.canvas.create_image(data['coords'][0], data['coords'][1],
                                                    image=font_img_tk, anchor="nw")
         self.config.canvas.tag_bind(text_id, "<Button-1>",
@@ -109,24 +110,56 @@ class FileMenu:
 
         self.config.text_items[text_id] = {
             "font_image": font_img_tk,
+            "bitmap": None,
             "font_props": data["font_props"],
             "content": data["content"],
             "handle": None,
             "bbox": None
         }
-
-    def load_image(self, data):
-        original_image_data = base64.b64decode(data["original_image"])
-        original_image = Image.open(io.BytesIO(original_image_data))
-
-        image_data = base64.b64decode(data["image"])
-        image = Image.open(io.BytesIO(image_data))
+        return text_id, future
+
+    def text_placeholder(self, font_props, text):
+        height = max(int(font_props["size"] * TEXT_RENDER_DPI / 72), 1)
+        width = max(len(text) * height // 2, 1)
+        return ImageTk.PhotoImage(Image.new("RGBA", (width, height), (200, 200, 200, 160)))
+
+    def update_text_renders(self, canvas, pending_renders):
+        """Swap placeholders for rendered text, runs on the Tk thread until every render is done."""
+        if canvas is not self.config.canvas:
+            return  # Another file was opened or the label size changed while rendering
+        still_pending = []
+        for text_id, future in pending_renders:
+            if not future.done():
+                still_pending.append((text_id, future))
+                continue
+            if text_id not in self.config.text_items:
+                continue  # Deleted while rendering
+            try:
+                text_image = future.result()
+            except Exception as e:
+                logger.error(f"Failed to render text '{self.config.text_items[text_id]['content']}': {e}")
+                continue
+            font_img_tk = ImageTk.PhotoImage(text_image)
+            self.config.canvas.itemconfig(text_id, image=font_img_tk)
+            self.config.text_items[text_id]["font_image"] = font_img_tk
+            self.config.text_items[text_id]["bitmap"] = text_image
+        if still_pending:
+            self.root.after(TEXT_RENDER_POLL_MS, lambda: self.update_text_renders(canvas, still_pending))
+
+    def load_image(self, data, assets):
+        original_image = assets.image(data["original_image"])
+
+        image = original_image
+        size = tuple(data["size"])
+        if image.size != size:
+            image = original_image.resize(size, Image.Resampling.LANCZOS)
         img_tk = ImageTk.PhotoImage(image)
         image_id = self.config.canvas.create_image(data['coords'][0], data['coords'][1],
                                                    image=img_tk, anchor="nw")
 
         self.config.image_items[image_id] = {
             "image": img_tk,
+            "bitmap": image,
             "original_image": original_image,
             "bbox": None,
             "handle": None
@@ -1,5 +1,7 @@
 from PIL import Image, ImageTk
 
+from NiimPrintX.nimmy.imagecache import image_cache
+
 from devtools import debug
 
 
@@ -9,26 +11,27 @@ class ImageOperation:
 
     def load_image(self, file_path):
 
-        # Open the image and resize if necessary
-        image = Image.open(file_path)
-
         x1, y1, x2, y2 = self.config.canvas.bbox(self.config.bounding_box)
         canvas_width = x2 - x1
         canvas_height = y2 - y1
 
-        # Resize the image if it exceeds canvas dimensions
-        img_width, img_height = image.size
+        # Resize the image if it exceeds canvas dimensions, only the header is read for the size
+        img_width, img_height = image_cache.image_size(file_path)
         scale_factor = min(canvas_width / img_width, canvas_height / img_height)
         new_width = int(img_width * scale_factor)
         new_height = int(img_height * scale_factor)
 
-        resized_image = image.convert("RGBA").resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Icons used before come straight from the cache without touching the disk
+        resized_image = image_cache.variant(file_path, ("fit", new_width, new_height),
+                                            lambda path: self.decode_resized(Image.open(path),
+                                                                             (new_width, new_height)))
         img_tk = ImageTk.PhotoImage(resized_image)
 
         # Add the image to the canvas
         image_id = self.config.canvas.create_image(0, 0, image=img_tk, anchor="nw")
         self.config.image_items[image_id] = {
             "image": img_tk,
+            "bitmap": resized_image,
             "original_image": resized_image,
             "bbox": None,
             "handle": None
@@ -39,6 +42,22 @@ class ImageOperation:
                                     lambda event, img_id=image_id: self.select_image(event, img_id))
         self.config.canvas.tag_bind(image_id, "<Button1-Motion>", lambda e, img_id=image_id: self.move_image(e, img_id))
 
+    @staticmethod
+    def decode_resized(image, size):
+        """Decode close to the target size instead of decoding the full image and downsampling it.
+
+        The result is at most the label size in printer pixels, which is all that can ever be printed,
+        so that copy is what is kept as the original.
+        """
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale directly, this is a no-op for other formats
+        image.draft(None, size)
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            # Palette and bilevel images would be resized with nearest neighbour
+            image = image.convert("RGBA")
+        # reducing_gap shrinks by an integer factor with Image.reduce first, then LANCZOS does the rest
+        resized_image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        return resized_image.convert("RGBA")
+
     def start_image_resize(self, event, image_id):
         self.config.image_items[image_id]['initial_y'] = event.y
         self.config.image_items[image_id]['initial_x'] = event.x
@@ -112,6 +131,7 @@ class ImageOperation:
         # Update the canvas with the resized image
         self.config.canvas.itemconfig(image_id, image=img_tk)
         self.config.image_items[image_id]["image"] = img_tk
+        self.config.image_items[image_id]["bitmap"] = resized_image
 
         # Update the bounding box and handle
         self.update_image_bbox_and_handle(image_id)
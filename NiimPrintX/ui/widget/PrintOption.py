@@ -1,18 +1,19 @@
 import asyncio
-import io
-import os
+import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
-from PIL import Image, ImageTk
-import PIL
-import cairo
-import tempfile
+from PIL import ImageTk
+
+from NiimPrintX.nimmy.raster import DITHER_MODES
 
 from .PrinterOperation import PrinterOperation
 
 from devtools import debug
 
+PREVIEW_OFFSET_LIMIT = 5  # mm, same range as the offset spinboxes in the preview window
+PROGRESS_INTERVAL = 0.1  # Seconds between two print progress updates in the status bar
+
 
 class PrintOption:
     def __init__(self, root, parent, config):
@@ -20,24 +21,14 @@ class PrintOption:
         self.parent = parent
         self.config = config
         self.frame = ttk.Frame(parent)
+        self._progress_stage = None
+        self._progress_shown = 0.0
         self.create_widgets()
-        self.print_op = PrinterOperation(self.config)
-        self.check_heartbeat()
-
-    def check_heartbeat(self):
-        asyncio.run_coroutine_threadsafe(self.schedule_heartbeat(), self.root.async_loop)
-
-    async def schedule_heartbeat(self):
-        while True:
-            # debug(self.config.printer_connected, self.config.print_job)
-            if self.print_op.printer and not self.config.print_job:
-                # debug("connected")
-                state, hb = await self.print_op.heartbeat()
-                self.root.after(0, lambda: self.update_status(state, hb))
-            elif not self.config.print_job:
-                # debug("not connected")
-                self.root.after(0, lambda: self.update_status(False))
-            await asyncio.sleep(5)
+        # The printer's liveness monitor reports changes, nothing here has to poll it
+        self.print_op = PrinterOperation(self.config, on_status=self.on_printer_status)
+
+    def on_printer_status(self, connected, hb=None):
+        self.root.after(0, lambda: self.update_status(connected, hb))
 
     def update_status(self, connected=False, hb_data=None):
         # debug(hb_data)
@@ -71,6 +62,8 @@ class PrintOption:
 
     def _update_device_status(self, future):
         result = future.result()
+        self._progress_stage = None
+        self.root.after(0, self.root.status_bar.clear_progress)
         if self.config.printer_connected:
             self.connect_button.config(text="Disconnect")
             self.connect_button.config(state=tk.NORMAL)
@@ -81,20 +74,24 @@ class PrintOption:
         self.root.after(0, lambda: self.root.status_bar.update_status(result))
 
     def display_print(self):
-        # Export to PNG and display it in a pop-up window
-        if self.config.os_system == "Windows":
-            # Windows-specific logic using tempfile.mkstemp()
-            fd, tmp_file_path = tempfile.mkstemp(suffix=".png")
-            try:
-                self.export_to_png(tmp_file_path)  # Save to file
-                self.display_image_in_popup(tmp_file_path)  # Display in pop-up window
-            finally:
-                os.close(fd)  # Close the file descriptor
-                os.remove(tmp_file_path)  # Remove the temporary file
-        else:
-            with tempfile.NamedTemporaryFile(suffix=".png") as tmp_file:
-                self.export_to_png(tmp_file.name)  # Save to file
-                self.display_image_in_popup(tmp_file.name)
+        # Compose the label in memory and display it in a pop-up window
+        self.display_image_in_popup(self.compose_preview_base())
+
+    def compose_preview_base(self):
+        # Compose once with a margin wide enough for the offset spinboxes, offsets are then a crop of this image
+        self.preview_margin = self.mm_to_pixels(PREVIEW_OFFSET_LIMIT)
+        self.preview_base = self.export_to_png(output_filename=None, margin=self.preview_margin)
+        return self.offset_preview_image(0, 0)
+
+    def offset_preview_image(self, horizontal_offset_pixels, vertical_offset_pixels):
+        margin = self.preview_margin
+        if abs(horizontal_offset_pixels) > margin or abs(vertical_offset_pixels) > margin:
+            return None
+        width = self.preview_base.width - 2 * margin
+        height = self.preview_base.height - 2 * margin
+        left = margin + horizontal_offset_pixels
+        top = margin + vertical_offset_pixels
+        return self.preview_base.crop((left, top, left + width, top + height))
 
     def save_image(self):
         options = {
@@ -106,79 +103,74 @@ class PrintOption:
         # Open the save as dialog and get the selected file name
         file_path = filedialog.asksaveasfilename(**options)
         if file_path:
-            self.export_to_png(file_path)
-            self.display_image_in_popup(file_path)
+            image = self.compose_preview_base()
+            image.save(file_path, format="PNG")
+            self.display_image_in_popup(image)
 
     def mm_to_pixels(self, mm):
         inches = mm / 25.4
         return int(inches * self.config.print_dpi)
 
-    def export_to_png(self, output_filename=None, horizontal_offset=0.0, vertical_offset=0.0):
-        width = self.config.canvas.winfo_reqwidth()
-        height = self.config.canvas.winfo_reqheight()
-
-        horizontal_offset_pixels = self.mm_to_pixels(horizontal_offset)
-        vertical_offset_pixels = self.mm_to_pixels(vertical_offset)
-
+    def label_document(self):
+        """Describe what is on the canvas as a label document for the shared renderer."""
         x1, y1, x2, y2 = self.config.canvas.bbox(self.config.bounding_box)
+        document = {
+            "device": self.config.device,
+            "size": (x2 - x1, y2 - y1),
+            "dpi": self.config.print_dpi,
+            "text": [],
+            "image": []
+        }
 
-        x1 += horizontal_offset_pixels
-        y1 += vertical_offset_pixels
-        x2 += horizontal_offset_pixels
-        y2 += vertical_offset_pixels
-
-        bbox_width = x2 - x1
-        bbox_height = y2 - y1
-
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-        ctx = cairo.Context(surface)
-        ctx.set_source_rgb(1, 1, 1)  # White background
-        ctx.paint()
-
-        # Drawing images (if any)
         if self.config.image_items:
             for img_id, img_props in self.config.image_items.items():
                 coords = self.config.canvas.coords(img_id)
-                resized_image = ImageTk.getimage(img_props["image"])
-                with io.BytesIO() as buffer:
-                    resized_image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    img_surface = cairo.ImageSurface.create_from_png(buffer)
-                ctx.set_source_surface(img_surface, coords[0], coords[1])
-                ctx.paint()
-
-        # Drawing text items
+                document["image"].append({
+                    "coords": (coords[0] - x1, coords[1] - y1),
+                    "bitmap": self.item_bitmap(img_props, "image")
+                })
+
         if self.config.text_items:
             for text_id, text_props in self.config.text_items.items():
                 coords = self.config.canvas.coords(text_id)
-                resized_image = ImageTk.getimage(text_props["font_image"])
-                with io.BytesIO() as buffer:
-                    resized_image.save(buffer, format="PNG")
-                    buffer.seek(0)
-                    img_surface = cairo.ImageSurface.create_from_png(buffer)
-                ctx.set_source_surface(img_surface, coords[0], coords[1])
-                ctx.paint()
-
-        # Create a cropped surface to save
-        cropped_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(bbox_width), int(bbox_height))
-        cropped_ctx = cairo.Context(cropped_surface)
-        cropped_ctx.set_source_surface(surface, -x1, -y1)
-        cropped_ctx.paint()
+                document["text"].append({
+                    "content": text_props["content"],
+                    "font_props": text_props["font_props"],
+                    "coords": (coords[0] - x1, coords[1] - y1),
+                    "bitmap": self.text_bitmap(text_props)
+                })
+        return document
+
+    @staticmethod
+    def item_bitmap(props, tk_key):
+        # Items keep the PIL image they were drawn from, reading pixels back from Tk is the fallback
+        if props.get("bitmap") is not None:
+            return props["bitmap"]
+        return ImageTk.getimage(props[tk_key])
+
+    def text_bitmap(self, props):
+        # A text still rendering in the background shows a placeholder, render it here instead of printing that
+        if props.get("bitmap") is not None:
+            return props["bitmap"]
+        return self.config.label_renderer.render_text(props["font_props"], props["content"])
+
+    def export_to_png(self, output_filename=None, horizontal_offset=0.0, vertical_offset=0.0, margin=0):
+        label_image = self.config.label_renderer.compose(self.label_document(),
+                                                         horizontal_offset=self.mm_to_pixels(horizontal_offset),
+                                                         vertical_offset=self.mm_to_pixels(vertical_offset),
+                                                         margin=margin)
         if output_filename:
-            cropped_surface.write_to_png(output_filename)
+            label_image.save(output_filename, format="PNG")
         else:
-            image_bytes = cropped_surface.get_data()
-            img = Image.frombuffer("RGBA", (int(bbox_width), int(bbox_height)), image_bytes, "raw", "BGRA", 0, 1)
+            return label_image
 
-            return img
-
-    def display_image_in_popup(self, filename):
+    def display_image_in_popup(self, image):
         # Create a new Toplevel window
         popup = tk.Toplevel(self.root)
         popup.title("Preview Image")
 
-        # Load the PNG image with PIL and convert to ImageTk
-        self.print_image = Image.open(filename)
+        # Show the composed image directly, no need to go through a file
+        self.print_image = image
         img_tk = ImageTk.PhotoImage(self.print_image)
 
         # Create a Label to display the image
@@ -209,6 +201,22 @@ class PrintOption:
                                          )
         print_copy_dropdown.grid(row=0, column=3, padx=5, pady=5, sticky="w")
 
+        tk.Label(option_frame, text="Dither").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+        self.print_dither = tk.StringVar()
+        self.print_dither.set(DITHER_MODES[0])
+        dither_dropdown = ttk.Combobox(option_frame, textvariable=self.print_dither, values=DITHER_MODES,
+                                       state="readonly", width=9)
+        dither_dropdown.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+
+        tk.Label(option_frame, text="Threshold").grid(row=1, column=2, padx=20, pady=5, sticky="e")
+        self.print_threshold = tk.IntVar()
+        self.print_threshold.set(128)
+        threshold_dropdown = tk.Spinbox(option_frame, from_=0, to=255, increment=8,
+                                        textvariable=self.print_threshold,
+                                        width=4
+                                        )
+        threshold_dropdown.grid(row=1, column=3, padx=5, pady=5, sticky="w")
+
         offset_frame = tk.Frame(popup)
         offset_frame.grid(row=2, column=0, columnspan=4, padx=20, pady=10, sticky="ew")
 
@@ -242,9 +250,10 @@ class PrintOption:
         button_frame.grid(row=3, column=0, columnspan=4, padx=20, pady=10, sticky="ew")
 
         self.print_button = tk.Button(button_frame, text="Print",
-                                      command=lambda image=self.print_image, density=self.print_density.get(),
-                                                     quantity=self.print_copy.get(): self.print_label(image, density,
-                                                                                                      quantity))
+                                      command=lambda: self.print_label(self.print_image, self.print_density.get(),
+                                                                       self.print_copy.get(),
+                                                                       self.print_dither.get(),
+                                                                       self.print_threshold.get()))
         self.print_button.grid(row=0, column=0, padx=5, pady=10, sticky="ew")
 
         close_button = tk.Button(button_frame, text="Close", command=popup.destroy)
@@ -264,29 +273,43 @@ class PrintOption:
         horizontal_offset = self.horizontal_offset.get()
         vertical_offset = self.vertical_offset.get()
         debug(horizontal_offset, vertical_offset)
-        self.print_image = self.export_to_png(output_filename=None,
-                                              horizontal_offset=horizontal_offset,
-                                              vertical_offset=vertical_offset)
+        # Offsets only move the crop window over the cached composition
+        image = self.offset_preview_image(self.mm_to_pixels(horizontal_offset), self.mm_to_pixels(vertical_offset))
+        if image is None:
+            image = self.export_to_png(output_filename=None,
+                                       horizontal_offset=horizontal_offset,
+                                       vertical_offset=vertical_offset)
+        self.print_image = image
         img_tk = ImageTk.PhotoImage(self.print_image)
         self.image_label.config(image=img_tk)
         self.image_label.image = img_tk
-        self.print_button.config(command=lambda: self.print_label(self.print_image, self.print_density.get(), self.print_copy.get()))
 
 
-    def print_label(self, image, density, quantity):
+    def print_label(self, image, density, quantity, dither="diffusion", threshold=128):
         self.print_button.config(state=tk.DISABLED)
-        self.config.print_job = True
 
-        image = image.rotate(-int(90), PIL.Image.NEAREST, expand=True)
+        # The label is printed sideways, the encoder reads it column by column instead of rotating a copy
         future = asyncio.run_coroutine_threadsafe(
-            self.print_op.print(image, density, quantity), self.root.async_loop
+            self.print_op.print(image, density, quantity, dither, threshold, rotate=90,
+                                on_progress=self.on_print_progress),
+            self.root.async_loop
         )
         future.add_done_callback(lambda f: self._print_handler(f))
 
+    def on_print_progress(self, progress):
+        # Called from the printer's event loop for every row, the status bar is redrawn a few times a second
+        now = time.monotonic()
+        if progress["stage"] == self._progress_stage and now - self._progress_shown < PROGRESS_INTERVAL:
+            return
+        self._progress_stage = progress["stage"]
+        self._progress_shown = now
+        self.root.after(0, lambda: self.root.status_bar.update_progress(progress))
+
     def _print_handler(self, future):
         result = future.result()
+        self._progress_stage = None
+        self.root.after(0, self.root.status_bar.clear_progress)
         if result:
             # debug("print", result)
-            self.config.print_job = False
             self.root.after(0, lambda: self.root.status_bar.update_status(result))
         self.print_button.config(state=tk.NORMAL)
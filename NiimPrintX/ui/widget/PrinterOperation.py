@@ -1,31 +1,49 @@
 from tkinter import messagebox
 
 from NiimPrintX.nimmy.bluetooth import find_device
-from NiimPrintX.nimmy.printer import PrinterClient
+from NiimPrintX.nimmy.printer import PrinterClient, JobOutcome
+from NiimPrintX.nimmy.job import PrintJob, job_cache
+from NiimPrintX.nimmy.liveness import LivenessMonitor
+from NiimPrintX.nimmy.raster import ImageSource
 from NiimPrintX.nimmy.logger_config import get_logger
 
 logger = get_logger()
 
 
 class PrinterOperation:
-    def __init__(self, config):
+    def __init__(self, config, on_status=None):
         self.config = config
         self.printer = None
+        self.monitor = None
+        self.on_status = on_status  # Called with (connected, heartbeat) when the printer comes and goes
 
     async def printer_connect(self, model):
         try:
+            await self.stop_monitor()
+            if self.printer:
+                # The old client may still be reconnecting in the background, it must not keep the device
+                await self.printer.disconnect()
+                self.printer = None
             device = await find_device(model)
             self.printer = PrinterClient(device)
             if await self.printer.connect():
                 self.config.printer_connected = True
+                self.monitor = LivenessMonitor(self.printer, on_state_change=self.on_status)
+                self.monitor.start()
                 return True
         except Exception as e:
             logger.error(f"Failed to connect to printer {model}: {e}", exc_info=True)
             messagebox.showerror("Error", f"Cannot connect to printer {model}.")
             return False
 
+    async def stop_monitor(self):
+        if self.monitor:
+            await self.monitor.stop()
+            self.monitor = None
+
     async def printer_disconnect(self):
         try:
+            await self.stop_monitor()
             if self.config.printer_connected or self.printer:
                 await self.printer.disconnect()
             self.config.printer_connected = False
@@ -36,23 +54,22 @@ class PrinterOperation:
             messagebox.showerror("Error", f"{str(e)}.")
             return False
 
-    async def print(self, image, density, quantity):
+    async def print(self, image, density, quantity, dither="diffusion", threshold=128, rotate=0, on_progress=None):
         try:
-            if not self.config.printer_connected or not self.printer:
+            # An unreachable printer keeps its client, sending the job waits for its reconnect
+            if not self.printer:
                 await self.printer_connect(self.config.device)
 
-            await self.printer.print_image(image, density, quantity)
+            # Reprinting an unchanged label reuses the encoded rows from the job cache
+            key = job_cache.image_key(image, model=self.config.device, density=density, vertical_offset=0,
+                                      horizontal_offset=0, dither=dither, threshold=threshold, rotate=rotate)
+            job = job_cache.get_or_create(
+                key, lambda: PrintJob.from_source(ImageSource(image, rotate, dither, threshold), self.config.device,
+                                                  density))
+            if await self.printer.print_job(job, quantity, on_progress=on_progress) == JobOutcome.ABANDONED:
+                messagebox.showerror("Error", "Printing stopped, the connection to the printer was lost.")
+                return False
             return True
         except Exception as e:
             messagebox.showerror("Error", f"{str(e)}.")
             return False
-
-    async def heartbeat(self):
-        try:
-            if self.printer:
-                hb = await self.printer.heartbeat()
-                return True, hb
-        except Exception as e:
-            logger.warning(f"Heartbeat failed, printer disconnected: {e}")
-            self.printer = None
-            return False, {}
@@ -15,15 +15,19 @@ class StatusBar:
         self.status_frame = tk.Frame(self.parent, bd=1, relief=tk.SUNKEN)
         self.status_frame.pack(side=tk.BOTTOM, fill=tk.X)  # Place at the bottom and fill horizontally
 
-        # Create a canvas for the green circle
-        circle_canvas = tk.Canvas(self.status_frame, width=20, height=20, bd=0, highlightthickness=0)
-        circle_canvas.create_oval(4, 4, 16, 16, fill='red')  # Draw the green circle
-        circle_canvas.pack(side=tk.RIGHT, padx=10, pady=5)  # Pack to the right with padding
+        # Create a canvas for the connection circle, the oval is created once and recolored on updates
+        self.circle_canvas = tk.Canvas(self.status_frame, width=20, height=20, bd=0, highlightthickness=0)
+        self.circle = self.circle_canvas.create_oval(4, 4, 16, 16, fill='red')
+        self.circle_canvas.pack(side=tk.RIGHT, padx=10, pady=5)  # Pack to the right with padding
 
         # Create a label for the status message
         self.status_label = tk.Label(self.status_frame, text='Not connected', fg='red', font=('Arial', 10))
         self.status_label.pack(side=tk.RIGHT, padx=5)  # Align to the right with padding
 
+        # Print progress on the left, only shown while a label is printing
+        self.progress_bar = ttk.Progressbar(self.status_frame, length=150, mode='determinate')
+        self.progress_label = tk.Label(self.status_frame, font=('Arial', 10))
+
     def update_status(self, connection=True):
         """Update the status message and circle color to indicate connection."""
 
@@ -36,6 +40,29 @@ class StatusBar:
         # Update the status label text
         self.status_label.config(text=f'{text}', fg=f'{color}')
 
-        # Update the circle canvas color to green
-        canvas = self.status_frame.winfo_children()[0]
-        canvas.create_oval(4, 4, 16, 16, fill=f'{color}')  # Change color to green
+        # Update the circle color
+        self.circle_canvas.itemconfigure(self.circle, fill=f'{color}')
+
+    def update_progress(self, progress):
+        """Show a print progress event from ``PrinterClient.print_packets``."""
+        if progress["stage"] == "sending":
+            total = max(progress["rows_total"], 1)
+            value = progress["rows_sent"]
+            text = f"Sending {value}/{total} rows, {progress['bytes_per_second'] / 1024:.1f} KB/s"
+        elif progress["stage"] == "printing":
+            total = max(progress["pages_total"], 1)
+            value = progress["pages_done"]
+            text = f"Printing {value}/{total}"
+        else:
+            self.clear_progress()
+            return
+
+        self.progress_bar.config(maximum=total, value=value)
+        self.progress_label.config(text=text)
+        if not self.progress_bar.winfo_ismapped():
+            self.progress_bar.pack(side=tk.LEFT, padx=10, pady=5)
+            self.progress_label.pack(side=tk.LEFT, padx=5)
+
+    def clear_progress(self):
+        self.progress_bar.pack_forget()
+        self.progress_label.pack_forget()
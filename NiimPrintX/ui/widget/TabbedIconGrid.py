@@ -1,12 +1,40 @@
 import os
+import json
 import math
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
-import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageTk
+
+from NiimPrintX.nimmy.imagecache import image_cache
 
 from devtools import debug
 
+# Decoding happens on these threads, Tk objects are only ever created on the Tk thread
+_decoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="icon-decode")
+
+
+def read_catalog(folder):
+    """Return (filename, image, crop box) entries for a category, cropping is left to the caller."""
+    atlas_path = os.path.join(folder, "atlas.png")
+    index_path = os.path.join(folder, "atlas.json")
+    if os.path.exists(atlas_path) and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        atlas = image_cache.open_image(atlas_path)
+        return [(icon["name"], atlas, (icon["x"], icon["y"], icon["x"] + icon["w"], icon["y"] + icon["h"]))
+                for icon in index["icons"]]
+
+    # Fall back to the individual thumbnails if the atlas was not built
+    icon_folder = f"{folder}/50x50"
+    catalog = []
+    for filename in sorted(os.listdir(icon_folder)):
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            catalog.append((filename, image_cache.open_image(os.path.join(icon_folder, filename)), None))
+    return catalog
+
+
 class TabbedIconGrid(tk.Frame):
     def __init__(self, parent, base_folder, icon_size=(50, 50), columns=8, on_icon_selected=None, **kwargs):
         super().__init__(parent, **kwargs)
@@ -14,7 +42,7 @@ class TabbedIconGrid(tk.Frame):
         self.icon_size = icon_size
         self.columns = columns
         self.on_icon_selected = on_icon_selected
-        self.icon_cache = {}  # Store loaded icons to avoid redundant processing
+        self.icon_cache = {}  # Grid per category, created the first time its tab is shown
 
         self.notebook = ttk.Notebook(self)
         self.create_tabs()
@@ -39,92 +67,126 @@ class TabbedIconGrid(tk.Frame):
         # Get the corresponding tab frame
         tab_frame = notebook.nametowidget(notebook.tabs()[selected_tab_index])
 
-        # Check if icons are cached and load asynchronously if not
         if subfolder_name not in self.icon_cache:
             subfolder_path = os.path.join(self.base_folder, subfolder_name)
-            self.icon_cache[subfolder_name] = self.create_icon_grid(tab_frame, subfolder_path, subfolder_name)
-            self.icon_cache[subfolder_name].bind("<MouseWheel>",
-                                                 lambda e, canvas=self.icon_cache[subfolder_name]: self.on_mouse_wheel(
-                                                     e, canvas))
-
-        # Ensure the correct canvas is used for mouse wheel event
-        self.icon_cache[subfolder_name].configure(scrollregion=self.icon_cache[subfolder_name].bbox("all"))
-        self.icon_cache[subfolder_name].bind("<MouseWheel>",
-                                             lambda e, canvas=self.icon_cache[subfolder_name]: self.on_mouse_wheel(e,
-                                                                                                                   canvas))
-
-    def create_icon_grid(self, parent, folder, subfolder_name):
-        """Create a scrollable icon grid for a given folder."""
-        canvas = tk.Canvas(parent)  # Create canvas
-        v_scrollbar = ttk.Scrollbar(parent, orient="vertical", command=canvas.yview)  # Set up scrollbar
-        h_scrollbar = ttk.Scrollbar(parent, orient="horizontal", command=canvas.xview)
-        canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-
-        scrollable_frame = tk.Frame(canvas)
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all"),
-            )
-        )
-
-
-        # Add the scrollable frame to the canvas
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="n")
-        v_scrollbar.pack(side="right", fill="y")  # Pack the vertical scrollbar
-        h_scrollbar.pack(side="bottom", fill="x")  # Pack the horizontal scrollbar
-        canvas.pack(side="left", fill="both", expand=True)
-
-        # canvas.grid(row=0, column=0, sticky="nsew")  # Fill the parent container with the canvas
-        # v_scrollbar.grid(row=0, column=1, sticky="ns")  # Attach the vertical scrollbar
-        # h_scrollbar.grid(row=1, column=0, sticky="ew")
-
-        # Asynchronous loading of icons
-        threading.Thread(target=self.load_icons, args=(scrollable_frame, folder, subfolder_name)).start()
-        canvas.after(200, lambda: canvas.configure(scrollregion=canvas.bbox("all")))
-
-        # parent.grid_rowconfigure(0, weight=1)  # Allow the first row to expand
-        # parent.grid_columnconfigure(0, weight=1)
-
-        return canvas
-
-    def load_icons(self, frame, folder, subfolder_name):
-        """Load icons asynchronously."""
-        icon_folder = f"{folder}/50x50"
-        icons = []
-        for filename in os.listdir(icon_folder):
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                image_path = os.path.join(icon_folder, filename)
-                photo = ImageTk.PhotoImage(Image.open(image_path))
-                icons.append((filename, photo, subfolder_name))
-
-        # Create the grid with the loaded icons
-        grid_rows = math.ceil(len(icons) / self.columns)
-        for row in range(grid_rows):
-            for col in range(self.columns):
-                index = row * self.columns + col
-                if index < len(icons):
-                    filename, photo, subfolder_name = icons[index]
-                    icon_label = tk.Label(
-                        frame,
-                        image=photo,
-                        cursor="hand2",
-                        bd=2,
-                        relief=tk.RAISED,
-                        bg="white"
-                    )
-                    icon_label.grid(row=row, column=col, padx=5, pady=5)
-                    icon_label.bind("<Button-1>", lambda event, idx=index: self.on_icon_click(idx, icons))
-
-    def on_mouse_wheel(self, event, canvas):
-        """Handle mouse wheel scrolling."""
-        direction = 1 if event.delta < 0 else -1
-        for _ in range(3):  # More scrolling with each wheel event
-            canvas.yview_scroll(direction, "units")
+            grid = VirtualIconGrid(tab_frame, subfolder_path, subfolder_name, self.icon_size, self.columns,
+                                   self.on_icon_click)
+            grid.pack(fill="both", expand=True)
+            self.icon_cache[subfolder_name] = grid
 
-    def on_icon_click(self, index, icons):
+    def on_icon_click(self, filename, subfolder_name):
         """Handle icon click and trigger callback."""
-        filename, _, subfolder_name = icons[index]
         subpath = os.path.join(subfolder_name, "original", filename)
         if self.on_icon_selected:
             self.on_icon_selected(subpath)
+
+
+class VirtualIconGrid(tk.Frame):
+    """Icon grid drawn on one canvas, only the rows in the viewport have canvas items.
+
+    The canvas items are a fixed pool of slots which are moved and given new images while scrolling.
+    """
+    padding = 5
+    border = 2
+    photo_cache_size = 512  # PhotoImages kept around for icons that scrolled out of view
+    poll_interval = 30
+
+    def __init__(self, parent, folder, subfolder_name, icon_size, columns, on_click, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.subfolder_name = subfolder_name
+        self.icon_size = icon_size
+        self.columns = columns
+        self.on_click = on_click
+        self.cell_width = icon_size[0] + 2 * (self.padding + self.border)
+        self.cell_height = icon_size[1] + 2 * (self.padding + self.border)
+        self.catalog = None
+        self.photos = OrderedDict()
+        self.slots = []
+
+        self.canvas = tk.Canvas(self, width=self.cell_width * columns, highlightthickness=0, cursor="hand2")
+        v_scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        h_scrollbar = ttk.Scrollbar(self, orient="horizontal", command=self.canvas.xview)
+        self.canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        v_scrollbar.pack(side="right", fill="y")
+        h_scrollbar.pack(side="bottom", fill="x")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-1>", self.on_canvas_click)
+
+        self.loading = _decoder.submit(read_catalog, folder)
+        self.after(self.poll_interval, self.wait_for_catalog)
+
+    def wait_for_catalog(self):
+        if not self.loading.done():
+            self.after(self.poll_interval, self.wait_for_catalog)
+            return
+        self.catalog = self.loading.result()
+        rows = math.ceil(len(self.catalog) / self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.cell_width * self.columns, self.cell_height * rows))
+        self.refresh()
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def on_mouse_wheel(self, event):
+        """Handle mouse wheel scrolling."""
+        direction = 1 if event.delta < 0 else -1
+        for _ in range(3):  # More scrolling with each wheel event
+            self.canvas.yview_scroll(direction, "units")
+        self.refresh()
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        height = max(self.canvas.winfo_height(), self.cell_height)
+        rows = math.ceil(len(self.catalog) / self.columns)
+        # Keep one extra row above and below so scrolling does not show empty cells
+        first_row = max(int(top // self.cell_height) - 1, 0)
+        last_row = min(int((top + height) // self.cell_height) + 1, rows - 1)
+        return range(first_row * self.columns, min((last_row + 1) * self.columns, len(self.catalog)))
+
+    def refresh(self):
+        if not self.catalog:
+            return
+        visible = self.visible_range()
+
+        while len(self.slots) < len(visible):
+            frame = self.canvas.create_rectangle(0, 0, 0, 0, outline="grey60", width=self.border, fill="white")
+            image = self.canvas.create_image(0, 0, anchor="nw")
+            self.slots.append((frame, image))
+
+        for (frame, image), index in zip(self.slots, visible):
+            x = (index % self.columns) * self.cell_width + self.padding
+            y = (index // self.columns) * self.cell_height + self.padding
+            self.canvas.coords(frame, x, y, x + self.cell_width - 2 * self.padding,
+                               y + self.cell_height - 2 * self.padding)
+            self.canvas.coords(image, x + self.border, y + self.border)
+            self.canvas.itemconfigure(frame, state="normal")
+            self.canvas.itemconfigure(image, image=self.photo(index), state="normal")
+
+        for frame, image in self.slots[len(visible):]:
+            self.canvas.itemconfigure(frame, state="hidden")
+            self.canvas.itemconfigure(image, state="hidden")
+
+    def photo(self, index):
+        if index in self.photos:
+            self.photos.move_to_end(index)
+            return self.photos[index]
+
+        _, image, box = self.catalog[index]
+        photo = ImageTk.PhotoImage(image.crop(box) if box else image)
+        self.photos[index] = photo
+        while len(self.photos) > self.photo_cache_size:
+            self.photos.popitem(last=False)
+        return photo
+
+    def on_canvas_click(self, event):
+        if not self.catalog:
+            return
+        column = int(self.canvas.canvasx(event.x) // self.cell_width)
+        row = int(self.canvas.canvasy(event.y) // self.cell_height)
+        index = row * self.columns + column
+        if 0 <= column < self.columns and 0 <= index < len(self.catalog):
+            self.on_click(self.catalog[index][0], self.subfolder_name)
@@ -2,9 +2,7 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import font as tk_font
 import tkinter.messagebox as messagebox
-from wand.image import Image as WandImage
-from wand.drawing import Drawing as WandDrawing
-from wand.color import Color
+from PIL import ImageTk
 
 from devtools import debug
 
@@ -16,36 +14,11 @@ class TextOperation:
 
     # Function to add text to canvas and make it draggable
     def create_text_image(self, font_props, text):
-        with WandDrawing() as draw:
-            # draw.font = font_props["font_name"]
-            draw.font_family = font_props["family"]
-            draw.font_size = font_props["size"]
-            if font_props["slant"] == 'italic':
-                draw.font_style = 'italic'
-            if font_props["weight"] == 'bold':
-                draw.font_weight = 700
-            if font_props["underline"]:
-                draw.text_decoration = 'underline'
-            draw.text_kerning = font_props["kerning"]
-            draw.fill_color = Color('black')  # Set font color to black
-            draw.resolution = (300, 300)  # 300 DPI for high quality text rendering
-            metrics = draw.get_font_metrics(WandImage(width=1, height=1), text, multiline=False)
-            text_width = int(metrics.text_width) + 5
-            text_height = int(metrics.text_height) + 5
-
-            # Create a new WandImage
-            with WandImage(width=text_width, height=text_height, background=Color('transparent')) as img:
-                draw.text(x=2, y=int(text_height / 2 + metrics.ascender / 2), body=text)
-                draw(img)
-
-                # Ensure the image is in RGBA format
-                img.format = 'png'
-                img.alpha_channel = 'activate'  # Ensure alpha channel is active
-                img_blob = img.make_blob('png32')  # Use 'png32' for RGBA
-                # img.save(filename="test.png")
-                # Convert to format displayable in Tkinter
-                tk_image = tk.PhotoImage(data=img_blob)
-                return tk_image
+        text_image = self.config.label_renderer.render_text(font_props, text)
+        # Convert to format displayable in Tkinter, the PIL image is kept for export
+        tk_image = ImageTk.PhotoImage(text_image)
+        return tk_image, text_image
+
     def add_text_to_canvas(self):
         # Get the current text in the content_entry Entry widget
         text = self.parent.content_entry.get()
@@ -55,13 +28,14 @@ class TextOperation:
             messagebox.showerror("Error", f"Please enter text in content to add.")
             return
 
-        tk_image = self.create_text_image(font_props, text)
+        tk_image, text_image = self.create_text_image(font_props, text)
         text_id = self.config.canvas.create_image(0, 0, image=tk_image, anchor="nw", )
 
         self.config.canvas.tag_bind(text_id, "<Button-1>", lambda event, tid=text_id: self.select_text(event, tid))
         self.config.text_items[text_id] = {
             "font_props": font_props,
             "font_image": tk_image,
+            "bitmap": text_image,
             "content": text,
             "handle": None,
             "bbox": None,
@@ -116,9 +90,10 @@ class TextOperation:
         text = self.parent.content_entry.get()
         self.config.text_items[text_id]['content'] = text
         font_props = self.config.text_items[text_id]['font_props']
-        tk_image = self.create_text_image(font_props, text)
+        tk_image, text_image = self.create_text_image(font_props, text)
         self.config.canvas.itemconfig(text_id, image=tk_image)
         self.config.text_items[text_id]['font_image'] = tk_image
+        self.config.text_items[text_id]['bitmap'] = text_image
         self.update_bbox_and_handle(text_id)
 
     def draw_bounding_box(self, event, text_id):
@@ -157,10 +132,11 @@ class TextOperation:
     def resize_text(self, event, text_id):
         dy = event.y - self.config.text_items[text_id]['initial_y']
         new_size = max(8, self.config.text_items[text_id]['initial_size'] + dy // 10)
-        tk_image = self.create_text_image(self.config.text_items[text_id]["font_props"],
-                                          self.config.text_items[text_id]['content'])
+        tk_image, text_image = self.create_text_image(self.config.text_items[text_id]["font_props"],
+                                                      self.config.text_items[text_id]['content'])
         self.config.canvas.itemconfig(text_id, image=tk_image)
         self.config.text_items[text_id]['font_image'] = tk_image
+        self.config.text_items[text_id]['bitmap'] = text_image
         self.config.text_items[text_id]["font_props"]['size'] = new_size
         self.update_bbox_and_handle(text_id)
 
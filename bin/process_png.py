@@ -1,35 +1,141 @@
 import os
-import shutil
+import json
+import math
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-import subprocess
 import click
-import glob
+
+ATLAS_COLUMNS = 16
+THUMBNAIL_SIZE = (50, 50)
+MANIFEST_NAME = 'manifest.json'
+ATLAS_NAME = 'atlas.png'
+PARALLEL_THRESHOLD = 8  # Below this many changed files a process pool costs more than it saves
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def process_image(source_path, original_dir, resized_dir):
+    """Decode a source icon once and write the print-ready original and the black 50x50 thumbnail."""
+    filename = os.path.basename(source_path)
+    with Image.open(source_path) as image:
+        image = image.convert("RGBA")
+
+    image.save(os.path.join(original_dir, filename))
+
+    thumbnail = image.resize(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    # Same as colorizing with 100% black, only the alpha channel of the icon is kept
+    recolored = Image.new("RGBA", THUMBNAIL_SIZE, (0, 0, 0, 255))
+    recolored.putalpha(thumbnail.getchannel("A"))
+    recolored.save(os.path.join(resized_dir, filename))
+    return filename
+
+
+def build_atlas(thumbnail_dir, output_dir, icon_size=THUMBNAIL_SIZE):
+    """Pack all thumbnails of a category into atlas.png and write their offsets to atlas.json."""
+    filenames = sorted(f for f in os.listdir(thumbnail_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    columns = min(ATLAS_COLUMNS, max(len(filenames), 1))
+    rows = math.ceil(len(filenames) / columns)
+    atlas = Image.new("RGBA", (columns * icon_size[0], max(rows, 1) * icon_size[1]), (0, 0, 0, 0))
+
+    icons = []
+    for index, filename in enumerate(filenames):
+        x = (index % columns) * icon_size[0]
+        y = (index // columns) * icon_size[1]
+        with Image.open(os.path.join(thumbnail_dir, filename)) as image:
+            image = image.convert("RGBA")
+            atlas.paste(image, (x, y))
+            icons.append({"name": filename, "x": x, "y": y, "w": image.width, "h": image.height})
+
+    atlas.save(os.path.join(output_dir, ATLAS_NAME), optimize=True)
+    with open(os.path.join(output_dir, 'atlas.json'), 'w') as f:
+        json.dump({"icon_size": list(icon_size), "icons": icons}, f, separators=(',', ':'))
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def source_names(image_directory):
+    return sorted(filename for filename in os.listdir(image_directory)
+                  if filename.lower().endswith('.png') and filename != ATLAS_NAME)
+
+
+def remove_stale(manifest, sources, original_dir, resized_dir):
+    """Drop manifest entries and outputs of sources that were deleted, returns the removed names."""
+    removed = sorted(set(manifest) - set(sources))
+    for filename in removed:
+        for directory in (original_dir, resized_dir):
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[filename]
+    return removed
+
+
+def changed_sources(image_directory, manifest, original_dir, resized_dir):
+    """Yield (path, entry) for sources that differ from the manifest or whose outputs are missing."""
+    for filename in source_names(image_directory):
+        path = os.path.join(image_directory, filename)
+        stat = os.stat(path)
+        known = manifest.get(filename)
+        outputs_exist = (os.path.exists(os.path.join(original_dir, filename))
+                         and os.path.exists(os.path.join(resized_dir, filename)))
+        # Size and mtime are checked first so unchanged files are not even read
+        if known and outputs_exist and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            continue
+        entry = {"sha256": file_hash(path), "size": stat.st_size, "mtime": stat.st_mtime}
+        if known and outputs_exist and known["sha256"] == entry["sha256"]:
+            manifest[filename] = entry
+            continue
+        yield path, entry
 
 
 @click.command()
 @click.argument('image_directory', type=click.Path(exists=True))
-def process_images(image_directory):
+@click.option('--atlas-only', is_flag=True, help="Only rebuild the sprite atlas from the existing 50x50 folder")
+@click.option('-j', '--jobs', type=click.IntRange(1), default=None, help="Worker processes")
+def process_images(image_directory, atlas_only, jobs):
     # Create subdirectories
     original_dir = os.path.join(image_directory, 'original')
     resized_dir = os.path.join(image_directory, '50x50')
 
+    if atlas_only:
+        build_atlas(resized_dir, image_directory)
+        return
+
     os.makedirs(original_dir, exist_ok=True)
     os.makedirs(resized_dir, exist_ok=True)
 
-    # Copy files to subdirectories
-    for filename in glob.glob(os.path.join(image_directory, '*.png')):
-        shutil.copy(filename, original_dir)
-        shutil.copy(filename, resized_dir)
+    manifest_path = os.path.join(image_directory, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    # Only files recorded in the manifest are removed, outputs it does not know about are left alone
+    removed = remove_stale(manifest, source_names(image_directory), original_dir, resized_dir)
+    changed = list(changed_sources(image_directory, manifest, original_dir, resized_dir))
+
+    if len(changed) >= PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(process_image, [path for path, _ in changed],
+                          [original_dir] * len(changed), [resized_dir] * len(changed)))
+    else:
+        for path, _ in changed:
+            process_image(path, original_dir, resized_dir)
 
-    # Run mogrify commands
-    subprocess.run(['mogrify', '-resize', '50x50', os.path.join(resized_dir, '*.png')])
-    subprocess.run(['mogrify', '-format', 'png', '-alpha', 'on', os.path.join(resized_dir, '*.png')])
-    subprocess.run(['mogrify', '-fill', 'black', '-colorize', '100', os.path.join(resized_dir, '*.png')])
+    for path, entry in changed:
+        manifest[os.path.basename(path)] = entry
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
 
-    # Process images with PIL
-    for image_path in glob.glob(os.path.join(resized_dir, '*.png')):
-        with Image.open(image_path).convert("RGBA").resize((50, 50), Image.Resampling.LANCZOS) as image:
-            image.save(image_path)
+    # One image and index per category so the icon grid loads it with a single read
+    if changed or removed or not os.path.exists(os.path.join(image_directory, ATLAS_NAME)):
+        build_atlas(resized_dir, image_directory)
+    click.echo(f"Processed {len(changed)} changed image(s), removed {len(removed)} deleted image(s)")
 
 
 if __name__ == '__main__':
@@ -23,7 +23,6 @@ pkgs.mkShell {
       mdurl
       packaging
       pillow
-      pycairo
       pygments
       pyinstaller
       rich
@@ -32,7 +31,6 @@ pkgs.mkShell {
     ]))
 
     # Native System Libraries (Needed for C-extensions)
-    cairo
     pkg-config
     imagemagick
     zlib